@@ -0,0 +1,98 @@
+"""
+Validators and caching headers for conditional GETs.
+
+Titles carry the time they were last modified, so the ETag of a title, or of a page of titles, is
+computed from ids and modification times without serializing the body, and the summary's from
+when its snapshot was built. Requests whose 'If-None-Match' or 'If-Modified-Since' header still
+matches are answered with an empty 304, pages of titles are only validated by their ETag.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from fastapi import Request, Response
+
+import netflix_show_api.config as config
+
+CACHE_CONTROL = f"public, max-age={config.CONFIG.http_cache_max_age_seconds}"
+
+
+class Validators(NamedTuple):
+    etag: str
+    last_modified: Optional[datetime] = None
+
+    def headers(self) -> Dict[str, str]:
+        headers = {"ETag": self.etag, "Cache-Control": CACHE_CONTROL}
+        if self.last_modified is not None:
+            headers["Last-Modified"] = format_datetime(_utc(self.last_modified), usegmt=True)
+        return headers
+
+
+def _utc(dt: datetime) -> datetime:
+    # timestamps are stored naive, written by datetime.now in the local time of the api host,
+    # which is what astimezone assumes naive datetimes are in
+    return dt.astimezone(timezone.utc)
+
+
+def _etag(*parts) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b"\n")
+    return f'"{digest.hexdigest()}"'
+
+
+def _versions_etag(kind: str, versions: Iterable[Tuple[int, Optional[datetime]]]) -> str:
+    return _etag(kind, *(f"{id}@{modified}" for (id, modified) in versions))
+
+
+def title_validators(id: int, modified: Optional[datetime]) -> Validators:
+    return Validators(_versions_etag("title", [(id, modified)]), modified)
+
+
+def page_validators(versions: Iterable[Tuple[int, Optional[datetime]]]) -> Validators:
+    """
+    Validators for a page of titles with the given (id, modified) versions. Pages only carry an
+    ETag: a title deleted from a page is replaced by the next one, which may have been modified
+    long before, so the newest modification time on a page can go back and doesn't tell whether
+    the page changed.
+    """
+    return Validators(_versions_etag("titles", versions))
+
+
+def summary_validators(refreshed: Optional[datetime]) -> Validators:
+    return Validators(_etag("summary", refreshed), refreshed)
+
+
+def _etags(header: str) -> Iterable[str]:
+    # weak comparison, see RFC 7232 section 2.3.2
+    for etag in header.split(","):
+        etag = etag.strip()
+        yield etag[2:] if etag.startswith("W/") else etag
+
+
+def is_not_modified(request: Request, validators: Validators) -> bool:
+    """
+    Whether the client's copy is still current. 'If-Modified-Since' is only used when there is no
+    'If-None-Match', as RFC 7232 requires.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return if_none_match.strip() == "*" or validators.etag in _etags(if_none_match)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or validators.last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # http dates have a resolution of one second
+    return _utc(validators.last_modified).replace(microsecond=0) <= since
+
+
+def not_modified(validators: Validators, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(status_code=304, headers={**(headers or {}), **validators.headers()})
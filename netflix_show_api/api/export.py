@@ -0,0 +1,60 @@
+"""
+Encodes batches of netflix titles for the streaming export endpoint.
+"""
+import csv
+import io
+import json
+from datetime import date
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Sequence
+
+from ..parsers import ExportFormat
+from .serializers import json_default
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+
+def encode_ndjson(titles: List[Dict]) -> str:
+    return "".join(json.dumps(title, default=json_default) + "\n" for title in titles)
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ", ".join(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def encode_csv(titles: List[Dict], fields: Sequence[str]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        [_csv_value(title.get(field)) for field in fields] for title in titles
+    )
+    return buffer.getvalue()
+
+
+async def encode(
+    batches: AsyncGenerator[List[Dict], None], format_: ExportFormat, fields: Sequence[str]
+) -> AsyncIterator[str]:
+    """
+    Encodes each batch of titles as one chunk of the response body. 'batches' is closed when the
+    encoding ends or is closed itself, even if not every batch was read.
+    """
+    try:
+        if format_ == ExportFormat.CSV:
+            # the header goes out before the first batch is read
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(fields)
+            yield buffer.getvalue()
+            async for titles in batches:
+                yield encode_csv(titles, fields)
+        else:
+            async for titles in batches:
+                yield encode_ndjson(titles)
+    finally:
+        await batches.aclose()
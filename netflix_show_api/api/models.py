@@ -38,6 +38,15 @@ class NetflixTitle(BaseModel):
     duration: Optional[int] = None
     genres: Optional[List[str]] = None
     description: Optional[str] = None
+    # description snippet with search matches highlighted, only returned when requested
+    headline: Optional[str] = None
+
+
+class BulkCreateResult(BaseModel):
+    # position of the title in the request body
+    index: int
+    netflix_title: Optional[NetflixTitle] = None
+    error: Optional[str] = None
 
 
 BarPlot = Dict[str, int]
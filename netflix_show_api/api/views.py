@@ -2,36 +2,144 @@
 Contains views for rest api.
 """
 
-from typing import Dict, List, Optional
+from functools import wraps
+from typing import Callable, Dict, List, Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 
+import netflix_show_api.api.conditional as conditional
+import netflix_show_api.api.export as export
 import netflix_show_api.api.models as models
+import netflix_show_api.api.serializers as serializers
+import netflix_show_api.config as config
 
-from ..db import queries
+from ..db import invalidation, queries
 from ..loggers import set_logging_config
-from ..parsers import parse_delimited, parse_filter_parameter, parse_order_by, parse_search
+from ..parsers import (
+    CountMode,
+    ExportFormat,
+    InvalidCursorError,
+    parse_cursor,
+    parse_delimited,
+    parse_filter_parameter,
+    parse_order_by,
+    parse_search,
+)
 
 app = FastAPI()
 
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+HAS_NEXT_HEADER = "X-Has-Next"
+
+
+TOTAL_COUNT_HEADER = "X-Total-Count"
+
+
+TOTAL_PAGES_HEADER = "X-Total-Pages"
+
+
+if config.CONFIG.async_mode:
+    from ..db import async_queries
+
+    get_session = async_queries.get_session
+
+    async def _run(query: Callable, *args, **kwargs):
+        # await the asyncio counterpart of the synchronous query function
+        return await getattr(async_queries, query.__name__)(*args, **kwargs)
+
+    def _stream(query: Callable, *args, **kwargs):
+        # iterate the asyncio counterpart of the synchronous generator
+        return getattr(async_queries, query.__name__)(*args, **kwargs)
+
+    def _endpoint(handler: Callable) -> Callable:
+        return handler
+
+
+else:
+    get_session = queries.get_session
+
+    async def _run(query: Callable, *args, **kwargs):
+        # the endpoint is already running in the threadpool, see '_endpoint'
+        return query(*args, **kwargs)
+
+    async def _stream(query: Callable, *args, **kwargs):
+        iterator = query(*args, **kwargs)
+        try:
+            async for item in iterate_in_threadpool(iterator):
+                yield item
+        finally:
+            # closing the generator runs its cleanup, which iterate_in_threadpool leaves undone
+            await run_in_threadpool(iterator.close)
+
+    def _endpoint(handler: Callable) -> Callable:
+        """
+        Turns the async 'handler' into a plain function, so FastAPI runs it in the threadpool and
+        validates and serializes its response there too, off the event loop. Handlers only await
+        '_run', which never suspends in this mode, so the coroutine completes in one step.
+        """
+
+        @wraps(handler)
+        def run_handler(*args, **kwargs):
+            coroutine = handler(*args, **kwargs)
+            try:
+                coroutine.send(None)
+            except StopIteration as e:
+                return e.value
+            coroutine.close()
+            raise RuntimeError(f"Endpoint {handler.__name__!r} suspended outside of async mode.")
+
+        return run_handler
+
+
 def id_not_found(id: int) -> HTTPException:
     return HTTPException(status_code=404, detail=f"No netflix title found with id {id!r}.")
 
 
+@app.on_event("startup")
+def start_background_threads():
+    queries.start_summary_refresher()
+    invalidation.start_listener(queries.engine)
+
+
 @app.get("/summary", response_model=models.NetflixTitlesSummary)
-def get_summary_of_netflix_titles() -> models.NetflixTitlesSummary:
-    query_results: Dict = queries.get_summary_of_netflix_titles()
+@_endpoint
+async def get_summary_of_netflix_titles(
+    request: Request,
+    response: Response,
+    session=Depends(get_session),
+) -> models.NetflixTitlesSummary:
+    query_results, refreshed = await _run(queries.get_summary_snapshot, session=session)
+    validators = conditional.summary_validators(refreshed)
+    if conditional.is_not_modified(request, validators):
+        return conditional.not_modified(validators)
+    response.headers.update(validators.headers())
+    return models.NetflixTitlesSummary(**query_results)
+
+
+@app.post("/summary/refresh", response_model=models.NetflixTitlesSummary)
+@_endpoint
+async def refresh_summary_of_netflix_titles(
+    session=Depends(get_session),
+) -> models.NetflixTitlesSummary:
+    query_results: Dict = await _run(queries.refresh_summary_snapshot, force=True, session=session)
     return models.NetflixTitlesSummary(**query_results)
 
 
-# TODO: debug LIKE query in filter, it only seems to return one object
 @app.get(
     "/netflix-titles", response_model=List[models.NetflixTitle], response_model_exclude_none=True
 )
-def get_netflix_titles(
-    page: int = 1,
-    perpage: int = 10,
+@_endpoint
+async def get_netflix_titles(
+    request: Request,
+    response: Response,
+    page: int = Query(1, ge=1),
+    perpage: int = Query(10, ge=1),
     include: Optional[str] = None,
     exclude: Optional[str] = None,
     order_by: Optional[str] = None,
@@ -41,13 +149,86 @@ def get_netflix_titles(
     cast_member: Optional[str] = None,
     director: Optional[str] = None,
     release_year: Optional[str] = None,
+    cursor: Optional[str] = None,
+    headline: bool = False,
+    count: Optional[CountMode] = None,
+    session=Depends(get_session),
 ) -> List[models.NetflixTitle]:
-    query_results: List[Dict] = queries.get_netflix_titles(
-        page,
-        perpage,
-        parse_delimited(include),
-        parse_delimited(exclude),
-        parse_order_by(order_by),
+    """
+    Pages through netflix titles by 'page' number, or by passing the 'X-Next-Cursor' header of
+    the previous response as 'cursor', which costs the same no matter how deep the page is.
+
+    'search' accepts web search syntax, e.g. '"space station" -comedy'. Searches can be ordered
+    by 'relevance', best match first, and 'headline' adds highlighted description snippets.
+
+    Whether there is a next page is returned in the 'X-Has-Next' header. Passing 'count' as
+    'exact' or 'approximate' also returns the 'X-Total-Count' and 'X-Total-Pages' headers.
+
+    Pages carry an 'ETag' computed from the ids and modification times of their titles, so
+    requests for an unchanged page with a matching 'If-None-Match' get an empty 304.
+    """
+    try:
+        query_results: queries.NetflixTitlesPage = await _run(
+            queries.get_netflix_titles,
+            page,
+            perpage,
+            parse_delimited(include),
+            parse_delimited(exclude),
+            parse_order_by(order_by),
+            parse_search(search),
+            parse_filter_parameter(genre),
+            parse_filter_parameter(country),
+            parse_filter_parameter(cast_member),
+            parse_filter_parameter(director),
+            parse_filter_parameter(release_year, postprocess=int),
+            cursor=parse_cursor(cursor),
+            headline=headline,
+            count=count,
+            session=session,
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {HAS_NEXT_HEADER: str(query_results.has_next).lower()}
+    if query_results.next_cursor:
+        headers[NEXT_CURSOR_HEADER] = query_results.next_cursor
+    if query_results.total is not None:
+        headers[TOTAL_COUNT_HEADER] = str(query_results.total)
+        headers[TOTAL_PAGES_HEADER] = str(-(-query_results.total // perpage))
+    validators = conditional.page_validators(query_results.versions)
+    if conditional.is_not_modified(request, validators):
+        return conditional.not_modified(validators, headers)
+    headers.update(validators.headers())
+    if config.CONFIG.fast_responses:
+        # skips validating the results twice, the bytes are the same
+        return serializers.netflix_titles_response(
+            query_results.results, exclude_none=True, headers=headers
+        )
+    response.headers.update(headers)
+    return [models.NetflixTitle(**qr) for qr in query_results.results]
+
+
+@app.get("/netflix-titles/export", response_class=StreamingResponse)
+async def export_netflix_titles(
+    format_: ExportFormat = Query(ExportFormat.NDJSON, alias="format"),
+    include: Optional[str] = None,
+    exclude: Optional[str] = None,
+    search: Optional[str] = None,
+    genre: Optional[str] = None,
+    country: Optional[str] = None,
+    cast_member: Optional[str] = None,
+    director: Optional[str] = None,
+    release_year: Optional[str] = None,
+) -> StreamingResponse:
+    """
+    Streams every netflix title matching the filters as 'ndjson' or 'csv', ordered by id. Takes
+    the same filters and 'include' and 'exclude' fields as listing titles, without paging.
+    """
+    include, exclude = parse_delimited(include), parse_delimited(exclude)
+    # the export opens its own session, which has to outlive the request handler
+    batches = _stream(
+        queries.export_netflix_titles,
+        include,
+        exclude,
         parse_search(search),
         parse_filter_parameter(genre),
         parse_filter_parameter(country),
@@ -55,36 +236,87 @@ def get_netflix_titles(
         parse_filter_parameter(director),
         parse_filter_parameter(release_year, postprocess=int),
     )
-    return [models.NetflixTitle(**qr) for qr in query_results]
+    body = export.encode(batches, format_, queries.export_fields(include, exclude))
+    return StreamingResponse(
+        body,
+        media_type=export.MEDIA_TYPES[format_],
+        headers={"Content-Disposition": f'attachment; filename="netflix-titles.{format_.value}"'},
+        # runs once the response ends, also when the client disconnects mid stream, and closes
+        # the export's cursor and session
+        background=BackgroundTask(body.aclose),
+    )
 
 
 @app.get("/netflix-titles/{id}", response_model=models.NetflixTitle)
-def get_netflix_title_by_id(id: int) -> models.NetflixTitle:
-    query_result: Optional[Dict] = queries.get_netflix_title_by_id(id)
-    if query_result:
-        return models.NetflixTitle(**query_result)
-    raise id_not_found(id)
+@_endpoint
+async def get_netflix_title_by_id(
+    id: int, request: Request, response: Response, session=Depends(get_session)
+) -> models.NetflixTitle:
+    query_result: Optional[Dict] = await _run(queries.get_netflix_title_by_id, id, session=session)
+    if not query_result:
+        raise id_not_found(id)
+    validators = conditional.title_validators(id, query_result["modified"])
+    if conditional.is_not_modified(request, validators):
+        return conditional.not_modified(validators)
+    response.headers.update(validators.headers())
+    return models.NetflixTitle(**query_result)
 
 
 @app.post("/netflix-titles", response_model=models.NetflixTitle)
-def create_new_netflix_title(netflix_title: models.NetflixTitle) -> models.NetflixTitle:
-    query_result: Optional[Dict] = queries.create_new_netflix_title(netflix_title.dict())
+@_endpoint
+async def create_new_netflix_title(
+    netflix_title: models.NetflixTitle, session=Depends(get_session)
+) -> models.NetflixTitle:
+    query_result: Optional[Dict] = await _run(
+        queries.create_new_netflix_title, netflix_title.dict(), session=session
+    )
     if query_result:
         return models.NetflixTitle(**query_result)
     raise HTTPException(422, "Could not create resource for new netflix title object.")
 
 
+@app.post("/netflix-titles/bulk", response_model=List[models.BulkCreateResult])
+@_endpoint
+async def create_new_netflix_titles(
+    netflix_titles: List[models.NetflixTitle], session=Depends(get_session)
+) -> List[models.BulkCreateResult]:
+    """
+    Creates up to BULK_MAX_TITLES netflix titles in one transaction. Returns one result per title,
+    in request order, holding either the created title or the reason it was rejected.
+    """
+    if len(netflix_titles) > config.CONFIG.bulk_max_titles:
+        raise HTTPException(
+            413, f"At most {config.CONFIG.bulk_max_titles} netflix titles can be created at once."
+        )
+    query_result: Optional[List] = await _run(
+        queries.create_new_netflix_titles,
+        [netflix_title.dict() for netflix_title in netflix_titles],
+        session=session,
+    )
+    if query_result is None:
+        raise HTTPException(422, "Could not create resources for new netflix title objects.")
+    return [models.BulkCreateResult(**result._asdict()) for result in query_result]
+
+
 @app.put("/netflix-titles/{id}")
-def update_netflix_title(id: int, netflix_title: models.NetflixTitle) -> models.NetflixTitle:
-    query_result: Optional[Dict] = queries.update_netflix_title(id, netflix_title.dict())
+@_endpoint
+async def update_netflix_title(
+    id: int, netflix_title: models.NetflixTitle, session=Depends(get_session)
+) -> models.NetflixTitle:
+    query_result: Optional[Dict] = await _run(
+        queries.update_netflix_title, id, netflix_title.dict(), session=session
+    )
     if query_result:
         return models.NetflixTitle(**query_result)
     raise id_not_found(id)
 
 
 @app.delete("/netflix-titles/{id}")
-def delete_netflix_title(id: int) -> models.NetflixTitle:
-    query_result: Optional[Dict] = queries.delete_netflix_title_by_id(id)
+@_endpoint
+async def delete_netflix_title(id: int, session=Depends(get_session)) -> models.NetflixTitle:
+    query_result: Optional[Dict] = await _run(
+        queries.delete_netflix_title_by_id, id, session=session
+    )
     if query_result:
         return models.NetflixTitle(**query_result)
     raise id_not_found(id)
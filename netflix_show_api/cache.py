@@ -0,0 +1,701 @@
+"""
+Caching for query results.
+
+'timed_cache' stores results in an in-process LRU cache by default, or in a cache backend shared
+between workers, so that N workers do not compute the same expensive query N times.
+"""
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import timedelta
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterable,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+from urllib.parse import urlparse
+
+# ---------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------
+# SERIALIZATION
+# ---------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------
+
+
+_UNCOMPRESSED = b"p"
+
+
+_COMPRESSED = b"z"
+
+
+_COMPRESSION_THRESHOLD_BYTES = 1024
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Serializes 'value' with pickle, compressing payloads large enough to benefit from it.
+    """
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    if len(data) >= _COMPRESSION_THRESHOLD_BYTES:
+        return _COMPRESSED + zlib.compress(data, 1)
+    return _UNCOMPRESSED + data
+
+
+def loads(data: bytes) -> Any:
+    header, payload = data[:1], data[1:]
+    if header == _COMPRESSED:
+        payload = zlib.decompress(payload)
+    elif header != _UNCOMPRESSED:
+        raise ValueError(f"Unknown cache payload header {header!r}.")
+    return pickle.loads(payload)
+
+
+# ---------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------
+# CACHE BACKENDS
+# ---------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    expirations: int
+    currsize: int
+    maxsize: Optional[int]
+    currbytes: int
+    max_bytes: Optional[int]
+
+
+class CacheBackend:
+    """
+    Storage for cached values. Keys are canonical tuples built by 'make_cache_key' and are grouped
+    by namespace, so one backend can serve every cached function.
+    """
+
+    # whether the backend is visible to other workers
+    shared = False
+
+    def get(self, namespace: str, key: Hashable) -> Tuple[bool, Any]:
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: Hashable, value: Any, ttl: float):
+        raise NotImplementedError
+
+    def add(self, namespace: str, key: Hashable, value: Any, ttl: float) -> bool:
+        """
+        Sets 'key' only if it is absent or expired. Returns whether the value was set.
+        """
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: Hashable) -> bool:
+        raise NotImplementedError
+
+    def clear(self, namespace: str):
+        raise NotImplementedError
+
+    def info(self) -> CacheInfo:
+        raise NotImplementedError
+
+    def compute(
+        self,
+        namespace: str,
+        key: Hashable,
+        f: Callable[[], Any],
+        ttl: float,
+        lock_seconds: float = 30.0,
+        poll_seconds: float = 0.05,
+        is_current: Optional[Callable[[], bool]] = None,
+    ) -> Any:
+        """
+        Computes and stores the value for a missed key. On shared backends only the worker that
+        claims the key's lock computes it, while the others wait for the value to appear.
+
+        'is_current' is called once the value is stored. If it returns False, e.g. because the
+        cache was invalidated while the value was computed, the value is removed again.
+        """
+        if not self.shared:
+            value = f()
+            self._store(namespace, key, value, ttl, is_current)
+            return value
+
+        lock_key = ("__lock__", key)
+        if self.add(namespace, lock_key, True, lock_seconds):
+            try:
+                value = f()
+                self._store(namespace, key, value, ttl, is_current)
+                return value
+            finally:
+                self.delete(namespace, lock_key)
+
+        deadline = time.monotonic() + lock_seconds
+        while time.monotonic() < deadline:
+            time.sleep(poll_seconds)
+            found, value = self.get(namespace, key)
+            if found:
+                return value
+        # the worker holding the lock is stuck or gone, so stop waiting on it
+        return f()
+
+    def _store(
+        self,
+        namespace: str,
+        key: Hashable,
+        value: Any,
+        ttl: float,
+        is_current: Optional[Callable[[], bool]],
+    ):
+        self.set(namespace, key, value, ttl)
+        # checked after storing, an invalidation landing in between clears the value itself
+        if is_current is not None and not is_current():
+            self.delete(namespace, key)
+
+
+class TTLCache:
+    """
+    Thread safe mapping where every entry expires 'ttl' seconds after it was set, and the least
+    recently used entries are evicted once there are more than 'maxsize' entries or the pickled
+    values take up more than 'max_bytes'.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        maxsize: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._timer = timer
+        self._lock = threading.Lock()
+        # key -> (expires at, size in bytes, value), ordered from least to most recently used
+        self._entries: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._live_entry(key)
+            if entry is None:
+                self._misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return True, entry[2]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        size = self._size_of(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            self._set(key, value, size, ttl)
+
+    def add(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> bool:
+        size = self._size_of(value)
+        with self._lock:
+            if self._live_entry(key) is not None:
+                return False
+            self._set(key, value, size, ttl)
+            return True
+
+    def delete(self, key: Hashable) -> bool:
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def delete_where(self, predicate: Callable[[Hashable], bool]):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(
+                self._hits,
+                self._misses,
+                self._evictions,
+                self._expirations,
+                len(self._entries),
+                self.maxsize,
+                self._bytes,
+                self.max_bytes,
+            )
+
+    def _live_entry(self, key: Hashable) -> Optional[Tuple[float, int, Any]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= self._timer():
+            self._remove(key)
+            self._expirations += 1
+            return None
+        return entry
+
+    def _set(self, key: Hashable, value: Any, size: int, ttl: Optional[float]):
+        if key in self._entries:
+            self._remove(key)
+        ttl = self.ttl if ttl is None else ttl
+        self._entries[key] = (self._timer() + ttl, size, value)
+        self._bytes += size
+        while (self.maxsize is not None and len(self._entries) > self.maxsize) or (
+            self.max_bytes is not None and self._bytes > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+            self._evictions += 1
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _size_of(self, value: Any) -> int:
+        # sizes only matter when there is a byte budget, so skip pickling otherwise
+        if self.max_bytes is None:
+            return 0
+        try:
+            return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return sys.getsizeof(value)
+
+
+class InProcessBackend(CacheBackend):
+    """
+    Keeps values in a TTLCache local to the worker.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        maxsize: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        self._cache = TTLCache(ttl, maxsize=maxsize, max_bytes=max_bytes, timer=timer)
+
+    def get(self, namespace, key):
+        return self._cache.get((namespace, key))
+
+    def set(self, namespace, key, value, ttl):
+        self._cache.set((namespace, key), value, ttl)
+
+    def add(self, namespace, key, value, ttl):
+        return self._cache.add((namespace, key), value, ttl)
+
+    def delete(self, namespace, key):
+        return self._cache.delete((namespace, key))
+
+    def clear(self, namespace):
+        self._cache.delete_where(lambda key: key[0] == namespace)
+
+    def info(self):
+        return self._cache.info()
+
+
+def _digest(key: Hashable) -> str:
+    return hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+
+class _Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+
+    def count(self, found: bool, expired: bool = False):
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if expired:
+                self.expirations += 1
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Shares values between the workers on one host through a SQLite database file. Once the cache
+    holds more than 'maxsize' entries, the entries closest to expiring are evicted.
+    """
+
+    shared = True
+
+    _PRUNE_EVERY = 100
+
+    def __init__(
+        self, path: str, maxsize: Optional[int] = None, timer: Callable[[], float] = time.time
+    ):
+        self.path = path
+        self.maxsize = maxsize
+        self._timer = timer
+        self._local = threading.local()
+        self._counters = _Counters()
+        self._sets = 0
+        self._evictions = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections may not be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, namespace, key):
+        row = (
+            self._connection()
+            .execute(
+                "SELECT value, expires FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, _digest(key)),
+            )
+            .fetchone()
+        )
+        expired = row is not None and row[1] <= self._timer()
+        if row is None or expired:
+            self._counters.count(False, expired)
+            return False, None
+        self._counters.count(True)
+        return True, loads(row[0])
+
+    def set(self, namespace, key, value, ttl):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+            (namespace, _digest(key), dumps(value), self._timer() + ttl),
+        )
+        self._sets += 1
+        if self._sets % self._PRUNE_EVERY == 0:
+            self.prune()
+
+    def add(self, namespace, key, value, ttl):
+        now = self._timer()
+        cursor = self._connection().execute(
+            "INSERT INTO cache (namespace, key, value, expires) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (namespace, key) DO UPDATE "
+            "SET value = excluded.value, expires = excluded.expires WHERE cache.expires <= ?",
+            (namespace, _digest(key), dumps(value), now + ttl, now),
+        )
+        return cursor.rowcount == 1
+
+    def delete(self, namespace, key):
+        cursor = self._connection().execute(
+            "DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, _digest(key))
+        )
+        return cursor.rowcount == 1
+
+    def clear(self, namespace):
+        self._connection().execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+
+    def prune(self):
+        connection = self._connection()
+        connection.execute("DELETE FROM cache WHERE expires <= ?", (self._timer(),))
+        if self.maxsize is None:
+            return
+        cursor = connection.execute(
+            "DELETE FROM cache WHERE (namespace, key) IN ("
+            "SELECT namespace, key FROM cache ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+            (self.maxsize,),
+        )
+        self._evictions += max(cursor.rowcount, 0)
+
+    def info(self):
+        (size,) = self._connection().execute("SELECT count(*) FROM cache").fetchone()
+        return CacheInfo(
+            self._counters.hits,
+            self._counters.misses,
+            self._evictions,
+            self._counters.expirations,
+            size,
+            self.maxsize,
+            0,
+            None,
+        )
+
+
+class RedisError(Exception):
+    pass
+
+
+class RespConnection:
+    """
+    Minimal client for the redis serialization protocol, covering the commands the cache needs.
+    """
+
+    def __init__(self, host: str, port: int, db: int = 0, timeout: float = 5.0):
+        self._socket = socket.create_connection((host, port), timeout=timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._socket.makefile("rb")
+        if db:
+            self.execute("SELECT", db)
+
+    def execute(self, *args) -> Any:
+        self._socket.sendall(self._encode(args))
+        return self._read_reply()
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+    @staticmethod
+    def _encode(args: Iterable) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _read_reply(self) -> Any:
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by redis server.")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply {line!r}.")
+
+
+class RedisBackend(CacheBackend):
+    """
+    Shares values between every worker through a server speaking the redis protocol. Clearing a
+    namespace bumps its generation number, which is part of every key, so stale entries are never
+    read again and expire on their own.
+    """
+
+    shared = True
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "netflix_show_api:"):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self._local = threading.local()
+        self._counters = _Counters()
+
+    def _execute(self, *args) -> Any:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = RespConnection(self.host, self.port, self.db)
+            self._local.connection = connection
+        try:
+            return connection.execute(*args)
+        except (ConnectionError, OSError):
+            # drop the broken connection so the next command reconnects
+            self._local.connection = None
+            connection.close()
+            raise
+
+    def _generation_key(self, namespace: str) -> str:
+        return f"{self.prefix}{namespace}:generation"
+
+    def _key(self, namespace: str, key: Hashable) -> str:
+        generation = self._execute("GET", self._generation_key(namespace))
+        generation = int(generation) if generation is not None else 0
+        return f"{self.prefix}{namespace}:{generation}:{_digest(key)}"
+
+    def get(self, namespace, key):
+        data = self._execute("GET", self._key(namespace, key))
+        self._counters.count(data is not None)
+        if data is None:
+            return False, None
+        return True, loads(data)
+
+    def set(self, namespace, key, value, ttl):
+        self._execute("SET", self._key(namespace, key), dumps(value), "PX", int(ttl * 1000))
+
+    def add(self, namespace, key, value, ttl):
+        reply = self._execute(
+            "SET", self._key(namespace, key), dumps(value), "PX", int(ttl * 1000), "NX"
+        )
+        return reply == "OK"
+
+    def delete(self, namespace, key):
+        return self._execute("DEL", self._key(namespace, key)) == 1
+
+    def clear(self, namespace):
+        self._execute("INCR", self._generation_key(namespace))
+
+    def info(self):
+        return CacheInfo(self._counters.hits, self._counters.misses, 0, 0, 0, None, 0, None)
+
+
+MEMORY_BACKEND = "memory"
+
+
+SQLITE_BACKEND = "sqlite"
+
+
+REDIS_BACKEND = "redis"
+
+
+_DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "netflix_show_api_cache.sqlite3")
+
+
+def make_backend(
+    name: str, url: Optional[str] = None, maxsize: Optional[int] = None
+) -> Optional[CacheBackend]:
+    """
+    Creates the cache backend called 'name'. Returns None for the in-process backend, since each
+    cached function then keeps its own TTLCache.
+    """
+    name = name.lower()
+    if name == MEMORY_BACKEND:
+        return None
+    if name == SQLITE_BACKEND:
+        return SQLiteBackend(url or _DEFAULT_SQLITE_PATH, maxsize=maxsize)
+    if name == REDIS_BACKEND:
+        return RedisBackend(url or "redis://localhost:6379/0")
+    raise ValueError(f"Unknown cache backend {name!r}.")
+
+
+# ---------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------
+# CACHE DECORATOR
+# ---------------------------------------------------------------------------------------------------
+# ---------------------------------------------------------------------------------------------------
+
+
+def _canonical(value: Any) -> Hashable:
+    # sets and dicts are sorted so that keys have the same repr in every worker, regardless of
+    # hash randomization
+    if isinstance(value, (set, frozenset)):
+        return ("set", tuple(sorted((_canonical(v) for v in value), key=repr)))
+    if isinstance(value, dict):
+        items = ((k, _canonical(v)) for (k, v) in value.items())
+        return ("dict", tuple(sorted(items, key=repr)))
+    if isinstance(value, (list, tuple)) and not hasattr(value, "_fields"):
+        return tuple(_canonical(v) for v in value)
+    return value
+
+
+def make_cache_key(
+    signature: inspect.Signature, args: Tuple, kwargs: Dict, ignore: FrozenSet[str] = frozenset()
+) -> Hashable:
+    """
+    Builds the same key for every call that binds the same values to the same parameters, no matter
+    whether they were passed positionally, by keyword or left as defaults. Parameters named in
+    'ignore' are left out of the key.
+    """
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return tuple(
+        (name, _canonical(value))
+        for (name, value) in bound.arguments.items()
+        if name not in ignore
+    )
+
+
+def timed_cache(
+    maxsize: Optional[int] = 1024,
+    max_bytes: Optional[int] = None,
+    ignore: Iterable[str] = (),
+    timer: Callable[[], float] = time.monotonic,
+    backend: Optional[CacheBackend] = None,
+    **timedelta_kwargs,
+):
+    """
+    Decorator for caching calls to a function. Each result expires after the given timeout, and the
+    least recently used results are evicted when the cache is over 'maxsize' entries or
+    'max_bytes' bytes. Arguments named in 'ignore', like database sessions, do not affect the key.
+    Results are kept in this process unless a shared 'backend' is passed.
+
+    The decorated function exposes 'cache_info', 'cache_clear' and 'cache_evict', which removes
+    the entry for the given arguments.
+    """
+    ttl = timedelta(**timedelta_kwargs).total_seconds()
+    ignore = frozenset(ignore)
+
+    def _wrapper(f):
+        signature = inspect.signature(f)
+        namespace = f"{f.__module__}.{f.__qualname__}"
+        cache = backend
+        if cache is None:
+            cache = InProcessBackend(ttl, maxsize=maxsize, max_bytes=max_bytes, timer=timer)
+
+        # bumped before every eviction, so results computed across one are not kept
+        generation = [0]
+
+        def _key(args, kwargs):
+            return make_cache_key(signature, args, kwargs, ignore)
+
+        @functools.wraps(f)
+        def _wrapped(*args, **kwargs):
+            key = _key(args, kwargs)
+            try:
+                hash(key)
+            except TypeError:
+                return f(*args, **kwargs)
+            found, value = cache.get(namespace, key)
+            if found:
+                return value
+            started = generation[0]
+            return cache.compute(
+                namespace,
+                key,
+                lambda: f(*args, **kwargs),
+                ttl,
+                is_current=lambda: generation[0] == started,
+            )
+
+        def cache_evict(*args, **kwargs) -> bool:
+            generation[0] += 1
+            return cache.delete(namespace, _key(args, kwargs))
+
+        def cache_clear():
+            generation[0] += 1
+            cache.clear(namespace)
+
+        _wrapped.cache_info = cache.info
+        _wrapped.cache_clear = cache_clear
+        _wrapped.cache_evict = cache_evict
+        return _wrapped
+
+    return _wrapper
@@ -1,6 +1,6 @@
 import os
 from enum import Enum, auto
-from typing import Callable, NamedTuple
+from typing import Callable, Dict, NamedTuple, Optional
 
 ENVIRONMENT = "ENVIRONMENT"
 
@@ -20,6 +20,60 @@ CACHE_TIMEOUT_SECONDS = "CACHE_TIMEOUT_SECONDS"
 LOGGING_CONFIG = "LOGGING_CONFIG"
 
 
+SUMMARY_REFRESH_SECONDS = "SUMMARY_REFRESH_SECONDS"
+
+
+CACHE_MAX_ENTRIES = "CACHE_MAX_ENTRIES"
+
+
+CACHE_MAX_BYTES = "CACHE_MAX_BYTES"
+
+
+CACHE_BACKEND = "CACHE_BACKEND"
+
+
+CACHE_URL = "CACHE_URL"
+
+
+ASYNC_MODE = "ASYNC_MODE"
+
+
+DB_POOL_SIZE = "DB_POOL_SIZE"
+
+
+DB_MAX_OVERFLOW = "DB_MAX_OVERFLOW"
+
+
+DB_POOL_TIMEOUT = "DB_POOL_TIMEOUT"
+
+
+DB_POOL_PRE_PING = "DB_POOL_PRE_PING"
+
+
+DB_POOL_RECYCLE = "DB_POOL_RECYCLE"
+
+
+DB_STATEMENT_TIMEOUT_MS = "DB_STATEMENT_TIMEOUT_MS"
+
+
+DB_IDLE_IN_TRANSACTION_TIMEOUT_MS = "DB_IDLE_IN_TRANSACTION_TIMEOUT_MS"
+
+
+ID_STRATEGY = "ID_STRATEGY"
+
+
+ID_BLOCK_SIZE = "ID_BLOCK_SIZE"
+
+
+BULK_MAX_TITLES = "BULK_MAX_TITLES"
+
+
+FAST_RESPONSES = "FAST_RESPONSES"
+
+
+HTTP_CACHE_MAX_AGE_SECONDS = "HTTP_CACHE_MAX_AGE_SECONDS"
+
+
 class Environment(Enum):
     DEV = auto()
     PROD = auto()
@@ -31,6 +85,54 @@ class Config(NamedTuple):
     secret: str
     cache_timeout_seconds: int
     logging_config: str
+    summary_refresh_seconds: int = 10
+    cache_max_entries: int = 1024
+    cache_max_bytes: Optional[int] = None
+    # one of "memory", "sqlite" or "redis"
+    cache_backend: str = "memory"
+    # path of the sqlite database or url of the redis server
+    cache_url: Optional[str] = None
+    # serve requests with the asyncio engine instead of the threadpool and psycopg2
+    async_mode: bool = False
+    # connection pool settings, see sqlalchemy.create_engine
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30
+    db_pool_pre_ping: bool = True
+    db_pool_recycle: int = 1800
+    # server side timeouts, None to use the server's defaults
+    db_statement_timeout_ms: Optional[int] = None
+    db_idle_in_transaction_timeout_ms: Optional[int] = None
+    # how new ids are allocated, see netflix_show_api.db.ids
+    id_strategy: str = "sequence"
+    id_block_size: int = 100
+    # largest batch accepted by POST /netflix-titles/bulk
+    bulk_max_titles: int = 1000
+    # serialize title listings straight to json, see netflix_show_api.api.serializers
+    fast_responses: bool = False
+    # how long clients and shared caches may reuse a response before revalidating it
+    http_cache_max_age_seconds: int = 60
+
+
+def _optional_environment_variable(key: str, default, parse: Callable = str):
+    try:
+        value = os.environ[key]
+    except KeyError:
+        return default
+    try:
+        return parse(value)
+    except ValueError:
+        raise EnvironmentError(
+            f"Could not parse {key!r} environment variable with value of {value!r} to {parse.__name__}."
+        )
+
+
+def parse_bool(value: str) -> bool:
+    if value.lower() in ("1", "true", "yes", "on"):
+        return True
+    if value.lower() in ("0", "false", "no", "off", ""):
+        return False
+    raise ValueError(f"Could not parse {value!r} to bool.")
 
 
 def make_config() -> Config:
@@ -66,7 +168,87 @@ def make_config() -> Config:
     except KeyError:
         raise EnvironmentError(environment_error % LOGGING_CONFIG)
 
-    return Config(db_connection, environment, secret, cache_timeout_seconds, logging_config)
+    summary_refresh_seconds = _optional_environment_variable(SUMMARY_REFRESH_SECONDS, 10, int)
+    cache_max_entries = _optional_environment_variable(CACHE_MAX_ENTRIES, 1024, int)
+    cache_max_bytes = _optional_environment_variable(CACHE_MAX_BYTES, None, int)
+    cache_backend = _optional_environment_variable(CACHE_BACKEND, "memory")
+    cache_url = _optional_environment_variable(CACHE_URL, None)
+    async_mode = _optional_environment_variable(ASYNC_MODE, False, parse_bool)
+    db_pool_size = _optional_environment_variable(DB_POOL_SIZE, 5, int)
+    db_max_overflow = _optional_environment_variable(DB_MAX_OVERFLOW, 10, int)
+    db_pool_timeout = _optional_environment_variable(DB_POOL_TIMEOUT, 30, float)
+    db_pool_pre_ping = _optional_environment_variable(DB_POOL_PRE_PING, True, parse_bool)
+    db_pool_recycle = _optional_environment_variable(DB_POOL_RECYCLE, 1800, int)
+    db_statement_timeout_ms = _optional_environment_variable(DB_STATEMENT_TIMEOUT_MS, None, int)
+    db_idle_in_transaction_timeout_ms = _optional_environment_variable(
+        DB_IDLE_IN_TRANSACTION_TIMEOUT_MS, None, int
+    )
+    id_strategy = _optional_environment_variable(ID_STRATEGY, "sequence").lower()
+    id_block_size = _optional_environment_variable(ID_BLOCK_SIZE, 100, int)
+    bulk_max_titles = _optional_environment_variable(BULK_MAX_TITLES, 1000, int)
+    fast_responses = _optional_environment_variable(FAST_RESPONSES, False, parse_bool)
+    http_cache_max_age_seconds = _optional_environment_variable(
+        HTTP_CACHE_MAX_AGE_SECONDS, 60, int
+    )
+
+    return Config(
+        db_connection,
+        environment,
+        secret,
+        cache_timeout_seconds,
+        logging_config,
+        summary_refresh_seconds=summary_refresh_seconds,
+        cache_max_entries=cache_max_entries,
+        cache_max_bytes=cache_max_bytes,
+        cache_backend=cache_backend,
+        cache_url=cache_url,
+        async_mode=async_mode,
+        db_pool_size=db_pool_size,
+        db_max_overflow=db_max_overflow,
+        db_pool_timeout=db_pool_timeout,
+        db_pool_pre_ping=db_pool_pre_ping,
+        db_pool_recycle=db_pool_recycle,
+        db_statement_timeout_ms=db_statement_timeout_ms,
+        db_idle_in_transaction_timeout_ms=db_idle_in_transaction_timeout_ms,
+        id_strategy=id_strategy,
+        id_block_size=id_block_size,
+        bulk_max_titles=bulk_max_titles,
+        fast_responses=fast_responses,
+        http_cache_max_age_seconds=http_cache_max_age_seconds,
+    )
+
+
+def server_settings(config: Config) -> Dict[str, str]:
+    """
+    Postgres settings applied to every connection.
+    """
+    settings = {}
+    if config.db_statement_timeout_ms is not None:
+        settings["statement_timeout"] = str(config.db_statement_timeout_ms)
+    if config.db_idle_in_transaction_timeout_ms is not None:
+        settings["idle_in_transaction_session_timeout"] = str(
+            config.db_idle_in_transaction_timeout_ms
+        )
+    return settings
+
+
+def engine_options(config: Config) -> Dict:
+    """
+    Keyword arguments for sqlalchemy.create_engine, using psycopg2 style connection arguments.
+    """
+    options = {
+        "pool_size": config.db_pool_size,
+        "max_overflow": config.db_max_overflow,
+        "pool_timeout": config.db_pool_timeout,
+        "pool_pre_ping": config.db_pool_pre_ping,
+        "pool_recycle": config.db_pool_recycle,
+    }
+    settings = server_settings(config)
+    if settings:
+        options["connect_args"] = {
+            "options": " ".join(f"-c {key}={value}" for (key, value) in settings.items())
+        }
+    return options
 
 
 CONFIG = make_config()
@@ -0,0 +1,144 @@
+"""
+Asyncio versions of the public functions in 'queries', backed by SQLAlchemy's asyncio engine and
+the asyncpg driver.
+
+Each function runs its synchronous counterpart through 'AsyncSession.run_sync', so filtering,
+caching and cache invalidation are shared with the synchronous path, while database I/O is
+awaited on the event loop instead of blocking a threadpool worker. Cache access is not awaited,
+so only the in-process cache, which never does I/O or waits on other workers, can be used.
+"""
+import logging
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import netflix_show_api.config as config
+
+from ..cache import CacheBackend
+from . import queries
+
+logger = logging.getLogger(__name__)
+
+
+ASYNC_DRIVER = "postgresql+asyncpg"
+
+
+def async_connection_url(db_connection: str) -> str:
+    return str(make_url(db_connection).set(drivername=ASYNC_DRIVER))
+
+
+def async_engine_options(config_: config.Config) -> Dict:
+    options = config.engine_options(config_)
+    # asyncpg takes server settings directly instead of psycopg2's 'options' string
+    options.pop("connect_args", None)
+    settings = config.server_settings(config_)
+    if settings:
+        options["connect_args"] = {"server_settings": settings}
+    return options
+
+
+def check_cache_backend(backend: Optional[CacheBackend]):
+    # shared backends block on sockets or sqlite, and sleep while another worker holds a key's
+    # lock, which would stall every request on the event loop
+    if backend is not None and backend.shared:
+        raise ValueError(
+            f"{config.ASYNC_MODE} can't be used with {type(backend).__name__}, "
+            f"set {config.CACHE_BACKEND} to 'memory'."
+        )
+
+
+check_cache_backend(queries.CACHE_BACKEND)
+
+
+async_engine = create_async_engine(
+    async_connection_url(config.CONFIG.db_connection), **async_engine_options(config.CONFIG)
+)
+
+
+AsyncSessionMaker = sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    """
+    Request scoped asyncio session for use as a FastAPI dependency.
+    """
+    async with AsyncSessionMaker() as session:
+        yield session
+
+
+async def _run_sync(f: Callable, *args, session: Optional[AsyncSession] = None, **kwargs):
+    if session is None:
+        async with AsyncSessionMaker() as session:
+            return await _run_sync(f, *args, session=session, **kwargs)
+    return await session.run_sync(lambda sync_session: f(*args, session=sync_session, **kwargs))
+
+
+async def get_summary_of_netflix_titles(session: Optional[AsyncSession] = None) -> Dict:
+    return await _run_sync(queries.get_summary_of_netflix_titles, session=session)
+
+
+async def get_summary_snapshot(
+    session: Optional[AsyncSession] = None,
+) -> Tuple[Dict, datetime]:
+    return await _run_sync(queries.get_summary_snapshot, session=session)
+
+
+async def refresh_summary_snapshot(
+    force: bool = False, session: Optional[AsyncSession] = None
+) -> Optional[Dict]:
+    return await _run_sync(queries.refresh_summary_snapshot, force=force, session=session)
+
+
+async def get_netflix_titles(*args, **kwargs) -> queries.NetflixTitlesPage:
+    return await _run_sync(queries.get_netflix_titles, *args, **kwargs)
+
+
+async def export_netflix_titles(
+    *args, batch_size: int = queries.EXPORT_BATCH_SIZE, **kwargs
+) -> AsyncIterator[List[Dict]]:
+    """
+    Streams the titles of 'queries.export_query' through an asyncpg server side cursor, in batches
+    of up to 'batch_size' titles. Runs in its own session, which lives as long as the stream.
+    """
+    include, exclude = args[:2]
+    async with AsyncSessionMaker() as session:
+        statement = queries.export_query(session.sync_session, *args, **kwargs).statement
+        result = await session.stream(statement)
+        try:
+            async for rows in result.partitions(batch_size):
+                yield queries.export_batch(rows, include, exclude)
+        finally:
+            await result.close()
+
+
+async def get_netflix_title_by_id(
+    id: int, session: Optional[AsyncSession] = None
+) -> Optional[Dict]:
+    return await _run_sync(queries.get_netflix_title_by_id, id, session=session)
+
+
+async def create_new_netflix_title(
+    title_data: Dict, session: Optional[AsyncSession] = None
+) -> Optional[Dict]:
+    return await _run_sync(queries.create_new_netflix_title, title_data, session=session)
+
+
+async def create_new_netflix_titles(
+    titles_data: List[Dict], session: Optional[AsyncSession] = None
+) -> Optional[List[queries.BulkCreateResult]]:
+    return await _run_sync(queries.create_new_netflix_titles, titles_data, session=session)
+
+
+async def update_netflix_title(
+    id: int, title_data: Dict, session: Optional[AsyncSession] = None
+) -> Optional[Dict]:
+    return await _run_sync(queries.update_netflix_title, id, title_data, session=session)
+
+
+async def delete_netflix_title_by_id(
+    id: int, session: Optional[AsyncSession] = None
+) -> Optional[Dict]:
+    return await _run_sync(queries.delete_netflix_title_by_id, id, session=session)
@@ -0,0 +1,201 @@
+"""
+Merges director and cast member rows that name the same person.
+
+The unique constraints on names stop exact duplicates, but names that differ only in case or
+whitespace, e.g. "Martin Scorsese", "martin scorsese" and "Martin  Scorsese ", still end up as
+separate rows. Rows are grouped on their normalized name and each group is merged into one
+surviving row: association rows are repointed at the survivor and the other rows are deleted.
+
+Merges run in chunks of groups, each in its own short transaction, so only the rows being merged
+are locked and the merge can run against a live database.
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Iterator, List, NamedTuple, Tuple
+
+from sqlalchemy import text
+
+from . import invalidation
+from .schema import SUMMARY_SNAPSHOT_ID, SummarySnapshot
+
+logger = logging.getLogger(__name__)
+
+
+# (table, association table, column of the association table referencing the table)
+PERSON_TABLES = (
+    ("director", "director_netflix_title", "director_id"),
+    ("cast_member", "cast_member_netflix_title", "cast_member_id"),
+)
+
+
+def normalize_name(name: str) -> str:
+    # trims and collapses whitespace, like _SQUISHED_NAME, so new names don't need merging later
+    return " ".join(name.split())
+
+
+_SQUISHED_NAME = r"regexp_replace(btrim(name), '\s+', ' ', 'g')"
+
+
+class MergeReport(NamedTuple):
+    table: str
+    # groups of rows that name the same person
+    groups: int = 0
+    # rows merged into a surviving row and deleted
+    merged: int = 0
+    # association rows repointed at a surviving row
+    repointed: int = 0
+
+    def __str__(self):
+        return (
+            f"{self.table}: merged {self.merged} rows in {self.groups} groups, "
+            f"repointed {self.repointed} association rows"
+        )
+
+
+def find_duplicate_groups(session, table_name: str) -> List[List[int]]:
+    """
+    Returns the ids of every group of rows in 'table_name' that name the same person, survivor
+    first. The survivor is the first created row whose name is already normalized, or the first
+    created row if none is. ids were random before they were drawn from sequences, so they only
+    break ties.
+    """
+    rows = session.execute(
+        text(
+            f"""
+            SELECT array_agg(id ORDER BY name <> {_SQUISHED_NAME}, created NULLS LAST, id)
+            FROM {table_name}
+            WHERE name IS NOT NULL
+            GROUP BY lower({_SQUISHED_NAME})
+            HAVING count(*) > 1
+            """
+        )
+    )
+    return [list(ids) for (ids,) in rows]
+
+
+def chunked(groups: List[List[int]], chunk_size: int) -> Iterator[Tuple[List[int], List[int]]]:
+    """
+    Yields (duplicate ids, survivor ids) pairs of lists, covering 'chunk_size' groups at a time.
+    """
+    for start in range(0, len(groups), chunk_size):
+        duplicate_ids, survivor_ids = [], []
+        end = start + chunk_size
+        for (survivor_id, *group_duplicate_ids) in groups[start:end]:
+            duplicate_ids.extend(group_duplicate_ids)
+            survivor_ids.extend([survivor_id] * len(group_duplicate_ids))
+        yield duplicate_ids, survivor_ids
+
+
+def merge_chunk(
+    session,
+    table_name: str,
+    association_table: str,
+    related_id: str,
+    duplicate_ids: List[int],
+    survivor_ids: List[int],
+) -> Tuple[int, int]:
+    """
+    Merges each row in 'duplicate_ids' into the row at the same position in 'survivor_ids' in the
+    session's transaction. Returns the number of rows merged and association rows repointed.
+    """
+    params = {"duplicate_ids": duplicate_ids, "survivor_ids": survivor_ids}
+    # the names of the titles related to the group may change, which has to change their etags.
+    # 'modified' is written in the local time of the host, like the api writes it.
+    session.execute(
+        text(
+            f"""
+            UPDATE netflix_title SET modified = :now
+            WHERE id IN (
+                SELECT netflix_title_id FROM {association_table}
+                WHERE {related_id} = ANY(
+                    CAST(:duplicate_ids AS integer[]) || CAST(:survivor_ids AS integer[])
+                )
+            )
+            """
+        ),
+        {**params, "now": datetime.now()},
+    )
+    # a title related to both rows keeps a single association row
+    repointed = session.execute(
+        text(
+            f"""
+            INSERT INTO {association_table}
+                (created, modified, deleted, netflix_title_id, {related_id})
+            SELECT a.created, a.modified, a.deleted, a.netflix_title_id, m.survivor_id
+            FROM {association_table} AS a
+            JOIN unnest(CAST(:duplicate_ids AS integer[]), CAST(:survivor_ids AS integer[]))
+                AS m (duplicate_id, survivor_id)
+                ON a.{related_id} = m.duplicate_id
+            ON CONFLICT DO NOTHING
+            """
+        ),
+        params,
+    ).rowcount
+    session.execute(
+        text(
+            f"DELETE FROM {association_table} "
+            f"WHERE {related_id} = ANY(CAST(:duplicate_ids AS integer[]))"
+        ),
+        params,
+    )
+    merged = session.execute(
+        text(f"DELETE FROM {table_name} WHERE id = ANY(CAST(:duplicate_ids AS integer[]))"),
+        params,
+    ).rowcount
+    # the survivor takes the normalized name, which is free now its duplicates are gone
+    session.execute(
+        text(
+            f"UPDATE {table_name} SET name = {_SQUISHED_NAME} "
+            f"WHERE id = ANY(CAST(:survivor_ids AS integer[])) AND name <> {_SQUISHED_NAME}"
+        ),
+        params,
+    )
+    return merged, repointed
+
+
+def merge_duplicates(
+    session,
+    table_name: str,
+    association_table: str,
+    related_id: str,
+    chunk_size: int = 500,
+    pause_seconds: float = 0.0,
+    dry_run: bool = False,
+) -> MergeReport:
+    """
+    Merges every group of rows in 'table_name' that name the same person, committing after every
+    'chunk_size' groups and sleeping 'pause_seconds' in between, e.g. to let replicas catch up.
+    """
+    groups = find_duplicate_groups(session, table_name)
+    # don't hold the snapshot taken to find the groups while merging
+    session.rollback()
+    report = MergeReport(table_name, groups=len(groups))
+    if dry_run:
+        return report._replace(merged=sum(len(group) - 1 for group in groups))
+
+    for (duplicate_ids, survivor_ids) in chunked(groups, chunk_size):
+        try:
+            merged, repointed = merge_chunk(
+                session, table_name, association_table, related_id, duplicate_ids, survivor_ids
+            )
+            _mark_stale(session)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        report = report._replace(
+            merged=report.merged + merged, repointed=report.repointed + repointed
+        )
+        logger.info(str(report))
+        if pause_seconds:
+            time.sleep(pause_seconds)
+    return report
+
+
+def _mark_stale(session):
+    # cached titles, listings and summaries may name merged rows
+    session.query(SummarySnapshot).filter(SummarySnapshot.id == SUMMARY_SNAPSHOT_ID).update(
+        {"dirty": True}, synchronize_session=False
+    )
+    invalidation.publish(session, invalidation.EVERYTHING_DIRTY)
@@ -0,0 +1,73 @@
+"""
+Id allocation for tables that inherit 'id' from 'schema.Base'.
+
+Every table has a '<table>_id_seq' sequence, which starts after the largest id assigned before
+sequences were introduced. Ids are either drawn from the sequence on every insert, or reserved
+from it in blocks that each worker process hands out from memory. Both draw from the same
+sequence, so they never collide with each other, and workers using either can run side by side.
+"""
+import threading
+from collections import deque
+from typing import Deque, Dict
+
+from sqlalchemy import Sequence, text
+
+SEQUENCE = "sequence"
+
+
+BLOCK = "block"
+
+
+ID_STRATEGIES = (SEQUENCE, BLOCK)
+
+
+def sequence_name(tablename: str) -> str:
+    return f"{tablename}_id_seq"
+
+
+def reserve_ids(connection, tablename: str, count: int):
+    """
+    Reserves 'count' ids from the table's sequence in one round trip. Sequences are not
+    transactional, so the ids stay reserved even if the caller's transaction rolls back.
+    """
+    return [
+        id
+        for (id,) in connection.execute(
+            text("SELECT nextval(:sequence) FROM generate_series(1, :count)"),
+            {"sequence": sequence_name(tablename), "count": count},
+        )
+    ]
+
+
+class BlockIdAllocator:
+    """
+    Column default handing out ids from blocks of 'block_size' ids reserved from the sequence, so
+    that most inserts don't wait on the sequence. Ids left in a block when the process exits are
+    never used.
+    """
+
+    def __init__(self, tablename: str, block_size: int):
+        self.tablename = tablename
+        self.block_size = block_size
+        self._ids: Deque[int] = deque()
+        self._lock = threading.Lock()
+
+    def __call__(self, context) -> int:
+        with self._lock:
+            if not self._ids:
+                self._ids.extend(reserve_ids(context.connection, self.tablename, self.block_size))
+            return self._ids.popleft()
+
+
+_allocators: Dict[str, BlockIdAllocator] = {}
+
+
+def id_default(tablename: str, strategy: str, block_size: int):
+    """
+    Returns the column default that allocates ids for 'tablename' with 'strategy'.
+    """
+    if strategy == SEQUENCE:
+        return Sequence(sequence_name(tablename))
+    if strategy == BLOCK:
+        return _allocators.setdefault(tablename, BlockIdAllocator(tablename, block_size))
+    raise ValueError(f"Unknown id strategy {strategy!r}, expected one of {ID_STRATEGIES!r}.")
@@ -0,0 +1,136 @@
+"""
+Cache invalidation events shared between workers with postgres LISTEN/NOTIFY.
+
+Write paths publish an event inside their transaction, so postgres delivers it to every listening
+worker when, and only if, the transaction commits. Each worker runs a listener thread that hands
+received events to the handlers registered with 'on_invalidation'.
+"""
+import json
+import logging
+import select
+import threading
+import time
+from typing import Callable, List, NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+
+CHANNEL = "netflix_title_invalidation"
+
+
+class InvalidationEvent(NamedTuple):
+    # id of a netflix title that was written to, if any
+    title_id: Optional[int] = None
+    # whether cached lists of titles and summaries are stale
+    lists_dirty: bool = False
+
+
+# sent after the listener reconnects, since notifications may have been missed in the meantime
+EVERYTHING_DIRTY = InvalidationEvent(title_id=None, lists_dirty=True)
+
+
+Handler = Callable[[InvalidationEvent], None]
+
+
+_handlers: List[Handler] = []
+
+
+def on_invalidation(handler: Handler) -> Handler:
+    """
+    Registers 'handler' to be called with every invalidation event received by this worker.
+    """
+    _handlers.append(handler)
+    return handler
+
+
+def encode_event(event: InvalidationEvent) -> str:
+    return json.dumps({"id": event.title_id, "lists": event.lists_dirty}, separators=(",", ":"))
+
+
+def decode_event(payload: str) -> InvalidationEvent:
+    try:
+        data = json.loads(payload)
+        return InvalidationEvent(title_id=data.get("id"), lists_dirty=bool(data.get("lists")))
+    except (ValueError, AttributeError):
+        logger.error("Could not decode invalidation payload %r. Invalidating everything." % payload)
+        return EVERYTHING_DIRTY
+
+
+def publish(session: Session, event: InvalidationEvent):
+    """
+    Queues 'event' on the session's transaction. Postgres delivers it to listeners on commit.
+    """
+    session.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": CHANNEL, "payload": encode_event(event)},
+    )
+
+
+def publish_many(session: Session, events: List[InvalidationEvent]):
+    """
+    Queues all of 'events' on the session's transaction in one statement.
+    """
+    session.execute(
+        text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) payload"),
+        {"channel": CHANNEL, "payloads": [encode_event(event) for event in events]},
+    )
+
+
+def dispatch(event: InvalidationEvent):
+    for handler in _handlers:
+        try:
+            handler(event)
+        except Exception as e:
+            logger.error("Suppressing error %r in invalidation handler %r." % (e, handler))
+
+
+def _listen(engine: Engine, poll_seconds: float):
+    connection = engine.raw_connection()
+    # the listener holds its connection for as long as it runs, so keep it out of the pool
+    connection.detach()
+    dbapi_connection = connection.connection
+    try:
+        dbapi_connection.autocommit = True
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        logger.info("Listening for invalidation events on channel %r." % CHANNEL)
+        dispatch(EVERYTHING_DIRTY)
+        while True:
+            readable, _, _ = select.select([dbapi_connection], [], [], poll_seconds)
+            if readable:
+                dbapi_connection.poll()
+            else:
+                # a dropped connection is silent, so check it is alive. If it isn't this raises,
+                # and the listener reconnects and invalidates everything.
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            while dbapi_connection.notifies:
+                notification = dbapi_connection.notifies.pop(0)
+                dispatch(decode_event(notification.payload))
+    finally:
+        connection.close()
+
+
+def start_listener(
+    engine: Engine, poll_seconds: float = 5.0, reconnect_seconds: float = 5.0
+) -> threading.Thread:
+    """
+    Starts a daemon thread that listens for invalidation events and dispatches them to the
+    registered handlers, reconnecting whenever the connection is lost.
+    """
+
+    def _listen_forever():
+        while True:
+            try:
+                _listen(engine, poll_seconds)
+            except Exception as e:
+                logger.error("Invalidation listener failed with %r. Reconnecting." % e)
+                time.sleep(reconnect_seconds)
+
+    thread = threading.Thread(target=_listen_forever, name="invalidation-listener", daemon=True)
+    thread.start()
+    return thread
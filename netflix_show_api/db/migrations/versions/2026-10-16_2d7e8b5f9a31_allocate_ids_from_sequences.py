@@ -0,0 +1,45 @@
+"""allocate ids from sequences
+
+Revision ID: 2d7e8b5f9a31
+Revises: f41c7a9d2e65
+Create Date: 2026-10-16 20:48:09.631552
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "2d7e8b5f9a31"
+down_revision = "f41c7a9d2e65"
+branch_labels = None
+depends_on = None
+
+
+# tables with an 'id' primary key, see netflix_show_api.db.ids
+TABLES = (
+    "cast_member",
+    "director",
+    "country",
+    "genre",
+    "netflix_title",
+    "summary_snapshot",
+)
+
+
+def upgrade():
+    for table_name in TABLES:
+        sequence_name = f"{table_name}_id_seq"
+        op.execute(f"CREATE SEQUENCE {sequence_name} AS integer OWNED BY {table_name}.id")
+        # start after every id assigned so far, so existing ids stay valid
+        op.execute(
+            f"SELECT setval('{sequence_name}', coalesce(max(id), 0) + 1, false) FROM {table_name}"
+        )
+        # lets inserts from outside the api, e.g. psql or COPY, leave out the id
+        op.execute(
+            f"ALTER TABLE {table_name} ALTER COLUMN id SET DEFAULT nextval('{sequence_name}')"
+        )
+
+
+def downgrade():
+    for table_name in TABLES:
+        op.execute(f"ALTER TABLE {table_name} ALTER COLUMN id DROP DEFAULT")
+        op.execute(f"DROP SEQUENCE {table_name}_id_seq")
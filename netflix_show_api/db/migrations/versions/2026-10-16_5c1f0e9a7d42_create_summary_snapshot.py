@@ -0,0 +1,41 @@
+"""create summary snapshot
+
+Revision ID: 5c1f0e9a7d42
+Revises: 37b7d50b1512
+Create Date: 2026-10-16 09:12:04.518230
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "5c1f0e9a7d42"
+down_revision = "37b7d50b1512"
+branch_labels = None
+depends_on = None
+
+
+SUMMARY_SNAPSHOT_ID = 1
+
+
+def upgrade():
+    summary_snapshot = op.create_table(
+        "summary_snapshot",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("created", sa.DateTime(), nullable=True),
+        sa.Column("modified", sa.DateTime(), nullable=True),
+        sa.Column("deleted", sa.DateTime(), nullable=True),
+        sa.Column("summary", postgresql.JSONB(), nullable=True),
+        sa.Column("dirty", sa.Boolean(), nullable=False),
+        sa.Column("refreshed", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    # starts out dirty so the first refresh builds the snapshot
+    op.execute(
+        summary_snapshot.insert().values(id=SUMMARY_SNAPSHOT_ID, created=sa.func.now(), dirty=True)
+    )
+
+
+def downgrade():
+    op.drop_table("summary_snapshot")
@@ -0,0 +1,81 @@
+"""add unique constraints on names
+
+Revision ID: 6a0c3e5d8b47
+Revises: 2d7e8b5f9a31
+Create Date: 2026-10-16 22:14:37.208416
+
+Rows with the same name are merged before each constraint is added. Unlike
+scripts/dedupe_names.py this is not chunked: adding a unique constraint takes an ACCESS EXCLUSIVE
+lock on the table until the migration commits anyway, so each named table and its association
+table are locked for the whole merge, and reads and writes of titles wait on them. Run it when
+writes can be paused, or run scripts/dedupe_names.py first so there is little left to merge.
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "6a0c3e5d8b47"
+down_revision = "2d7e8b5f9a31"
+branch_labels = None
+depends_on = None
+
+
+# (table, association table, column of the association table referencing the table)
+NAMED_TABLES = (
+    ("cast_member", "cast_member_netflix_title", "cast_member_id"),
+    ("director", "director_netflix_title", "director_id"),
+    ("country", "country_netflix_title", "country_id"),
+    ("genre", "genre_netflix_title", "genre_id"),
+)
+
+
+def _survivors(table_name: str) -> str:
+    # maps every duplicated row to the first created row with the same name. ids were random
+    # before they were drawn from sequences, so the smallest id is only a tiebreaker.
+    return f"""
+        SELECT id, survivor_id
+        FROM (
+            SELECT
+                id,
+                first_value(id) OVER (
+                    PARTITION BY name ORDER BY created NULLS LAST, id
+                ) AS survivor_id
+            FROM {table_name}
+            WHERE name IS NOT NULL
+        ) AS named
+        WHERE id <> survivor_id
+    """
+
+
+def upgrade():
+    for (table_name, association_table, related_id) in NAMED_TABLES:
+        # the constraint would reject rows with the same name, so merge them into the first one
+        op.execute(
+            f"""
+            INSERT INTO {association_table}
+                (created, modified, deleted, netflix_title_id, {related_id})
+            SELECT a.created, a.modified, a.deleted, a.netflix_title_id, s.survivor_id
+            FROM {association_table} AS a
+            JOIN ({_survivors(table_name)}) AS s ON a.{related_id} = s.id
+            ON CONFLICT DO NOTHING
+            """
+        )
+        op.execute(
+            f"""
+            DELETE FROM {association_table} AS a
+            USING ({_survivors(table_name)}) AS s
+            WHERE a.{related_id} = s.id
+            """
+        )
+        op.execute(
+            f"""
+            DELETE FROM {table_name} AS t
+            USING ({_survivors(table_name)}) AS s
+            WHERE t.id = s.id
+            """
+        )
+        op.create_unique_constraint(f"uq_{table_name}_name", table_name, ["name"])
+
+
+def downgrade():
+    for (table_name, _, _) in NAMED_TABLES:
+        op.drop_constraint(f"uq_{table_name}_name", table_name, type_="unique")
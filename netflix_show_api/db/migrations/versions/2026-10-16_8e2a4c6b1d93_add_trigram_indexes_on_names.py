@@ -0,0 +1,39 @@
+"""add trigram indexes on names
+
+Revision ID: 8e2a4c6b1d93
+Revises: 5c1f0e9a7d42
+Create Date: 2026-10-16 14:37:51.203114
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8e2a4c6b1d93"
+down_revision = "5c1f0e9a7d42"
+branch_labels = None
+depends_on = None
+
+
+TRIGRAM_INDEXES = (
+    ("idx_cast_member_name_trgm", "cast_member"),
+    ("idx_director_name_trgm", "director"),
+)
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for (index_name, table_name) in TRIGRAM_INDEXES:
+        op.create_index(
+            index_name,
+            table_name,
+            ["name"],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        )
+
+
+def downgrade():
+    for (index_name, table_name) in TRIGRAM_INDEXES:
+        op.drop_index(index_name, table_name=table_name)
+    # the extension is left installed, since other objects in the database may depend on it
@@ -0,0 +1,75 @@
+"""key association tables on id pairs
+
+Revision ID: b3d9f27e0c18
+Revises: 8e2a4c6b1d93
+Create Date: 2026-10-16 16:05:12.774390
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b3d9f27e0c18"
+down_revision = "8e2a4c6b1d93"
+branch_labels = None
+depends_on = None
+
+
+# (association table, column referencing the related table)
+ASSOCIATION_TABLES = (
+    ("cast_member_netflix_title", "cast_member_id"),
+    ("director_netflix_title", "director_id"),
+    ("country_netflix_title", "country_id"),
+    ("genre_netflix_title", "genre_id"),
+)
+
+
+def _reverse_index_name(table_name: str, related_id: str) -> str:
+    return f"idx_{table_name}_{related_id}"
+
+
+def upgrade():
+    for (table_name, related_id) in ASSOCIATION_TABLES:
+        # drop rows that the new primary key would reject, keeping one row for each pair of ids
+        op.execute(
+            f"DELETE FROM {table_name} WHERE {related_id} IS NULL OR netflix_title_id IS NULL"
+        )
+        op.execute(
+            f"""
+            DELETE FROM {table_name} AS duplicate
+            USING {table_name} AS kept
+            WHERE duplicate.netflix_title_id = kept.netflix_title_id
+                AND duplicate.{related_id} = kept.{related_id}
+                AND duplicate.id > kept.id
+            """
+        )
+        op.drop_constraint(f"{table_name}_pkey", table_name, type_="primary")
+        op.drop_column(table_name, "id")
+        op.alter_column(table_name, related_id, nullable=False)
+        op.alter_column(table_name, "netflix_title_id", nullable=False)
+        op.create_primary_key(f"{table_name}_pkey", table_name, ["netflix_title_id", related_id])
+        op.create_index(
+            _reverse_index_name(table_name, related_id),
+            table_name,
+            [related_id, "netflix_title_id"],
+            unique=True,
+        )
+
+
+def downgrade():
+    for (table_name, related_id) in ASSOCIATION_TABLES:
+        op.drop_index(_reverse_index_name(table_name, related_id), table_name=table_name)
+        op.drop_constraint(f"{table_name}_pkey", table_name, type_="primary")
+        op.alter_column(table_name, related_id, nullable=True)
+        op.alter_column(table_name, "netflix_title_id", nullable=True)
+        op.add_column(table_name, sa.Column("id", sa.Integer(), nullable=True))
+        op.execute(
+            f"""
+            UPDATE {table_name}
+            SET id = numbered.row_number
+            FROM (SELECT ctid, row_number() OVER () AS row_number FROM {table_name}) AS numbered
+            WHERE {table_name}.ctid = numbered.ctid
+            """
+        )
+        op.alter_column(table_name, "id", nullable=False)
+        op.create_primary_key(f"{table_name}_pkey", table_name, ["id"])
@@ -0,0 +1,49 @@
+"""add weighted search vector
+
+Revision ID: f41c7a9d2e65
+Revises: b3d9f27e0c18
+Create Date: 2026-10-16 18:22:40.118407
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "f41c7a9d2e65"
+down_revision = "b3d9f27e0c18"
+branch_labels = None
+depends_on = None
+
+
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
+
+
+def upgrade():
+    # expression index on the unweighted document, replaced by the index on the stored column
+    op.execute("DROP INDEX IF EXISTS idx_title_fts")
+    # generated columns need postgres 12 or later
+    op.add_column(
+        "netflix_title",
+        sa.Column(
+            "search_vector",
+            postgresql.TSVECTOR(),
+            sa.Computed(SEARCH_VECTOR_SQL, persisted=True),
+            nullable=True,
+        ),
+    )
+    op.create_index(
+        "idx_netflix_title_search_vector",
+        "netflix_title",
+        ["search_vector"],
+        unique=False,
+        postgresql_using="gin",
+    )
+
+
+def downgrade():
+    op.drop_index("idx_netflix_title_search_vector", table_name="netflix_title")
+    op.drop_column("netflix_title", "search_vector")
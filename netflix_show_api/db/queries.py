@@ -1,20 +1,57 @@
+import json
 import logging
-import math
-from collections import Counter
-from datetime import datetime
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, datetime
 from enum import Enum
-from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
-from sqlalchemy import create_engine, distinct, func, or_, tuple_
+from sqlalchemy import (
+    Integer,
+    and_,
+    cast,
+    create_engine,
+    distinct,
+    false,
+    func,
+    or_,
+    select,
+    tuple_,
+)
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION, TEXT, insert
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import Query, sessionmaker
+from sqlalchemy.sql.expression import ClauseElement, Executable
 
 import netflix_show_api.config as config
 import netflix_show_api.db.queries as queries
 import netflix_show_api.db.schema as db
 
-from ..loggers import log_calls, set_logging_config
-from ..parsers import FilterOperator, FilterParam, OrderByParam
-from ..utils import timed_cache
+from ..cache import make_backend, timed_cache
+from ..loggers import set_logging_config, trace_calls
+from ..parsers import (
+    CountMode,
+    FilterOperator,
+    FilterParam,
+    InvalidCursorError,
+    OrderByParam,
+    encode_cursor,
+    identity,
+)
+from . import invalidation
 from .constants import (
     COUNTRY_ALIASES,
     DURATION_UNIT_ALIASES,
@@ -22,17 +59,25 @@ from .constants import (
     RATING_ALIASES,
     TITLE_TYPE_ALIASES,
 )
+from .dedupe import normalize_name
+from .ids import reserve_ids
 from .schema import (
+    SUMMARY_SNAPSHOT_ID,
     Base,
     CastMember,
+    CastMemberNetflixTitle,
     Country,
     CountryEnum,
+    CountryNetflixTitle,
     Director,
+    DirectorNetflixTitle,
     DurationUnitEnum,
     Genre,
     GenreEnum,
+    GenreNetflixTitle,
     NetflixTitle,
     RatingEnum,
+    SummarySnapshot,
     TitleTypeEnum,
 )
 
@@ -42,16 +87,96 @@ set_logging_config()
 logger = logging.getLogger(__name__)
 
 
-engine = create_engine(config.CONFIG.db_connection)
+engine = create_engine(config.CONFIG.db_connection, **config.engine_options(config.CONFIG))
 
 
 Session = sessionmaker(bind=engine)
 
 
+@contextmanager
+def session_scope(session: Optional[Session] = None) -> Iterator[Session]:
+    """
+    Yields 'session' unchanged if one is passed. Otherwise yields a new session, which is closed
+    on exit so its connection goes straight back to the pool.
+    """
+    if session is not None:
+        yield session
+        return
+    session = Session()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def get_session() -> Iterator[Session]:
+    """
+    Request scoped session for use as a FastAPI dependency. Any transaction left open by the
+    request is rolled back, and the connection is returned to the pool, when the request ends.
+    """
+    with session_scope() as session:
+        yield session
+
+
 CACHE_TIMEOUT_SECONDS = config.CONFIG.cache_timeout_seconds
 
 
-MAX_INSERT_ATTEMPTS = 10
+SUMMARY_REFRESH_SECONDS = config.CONFIG.summary_refresh_seconds
+
+
+CACHE_MAX_ENTRIES = config.CONFIG.cache_max_entries
+
+
+CACHE_MAX_BYTES = config.CONFIG.cache_max_bytes
+
+
+# None when results are cached in each worker's memory
+CACHE_BACKEND = make_backend(
+    config.CONFIG.cache_backend, config.CONFIG.cache_url, maxsize=CACHE_MAX_ENTRIES
+)
+
+
+def _query_cache(*ignore: str):
+    # shared settings for the query caches below, ignoring the named non-semantic arguments
+    return timed_cache(
+        seconds=CACHE_TIMEOUT_SECONDS,
+        maxsize=CACHE_MAX_ENTRIES,
+        max_bytes=CACHE_MAX_BYTES,
+        ignore=ignore,
+        backend=CACHE_BACKEND,
+    )
+
+
+# labels of rank columns added to listings filtered with the 'similar' operator, or searched
+SIMILARITY_SORT_KEY = "similarity"
+RELEVANCE_SORT_KEY = "relevance"
+
+
+# label of the search snippet added to listings when requested
+HEADLINE_KEY = "headline"
+
+
+# text search configuration matching the one the search vector is generated with
+SEARCH_CONFIG = "english"
+
+
+# see https://www.postgresql.org/docs/current/textsearch-controls.html#TEXTSEARCH-HEADLINE
+HEADLINE_OPTIONS = "StartSel=<b>, StopSel=</b>, MaxWords=35, MinWords=15, MaxFragments=2"
+
+
+# rows fetched from the server side cursor at a time when exporting titles
+EXPORT_BATCH_SIZE = 1000
+
+
+class NetflixTitlesPage(NamedTuple):
+    results: List[Dict]
+    # opaque cursor for fetching the page after this one, None on the last page
+    next_cursor: Optional[str]
+    has_next: bool = False
+    # number of titles matching the filters, if requested
+    total: Optional[int] = None
+    # (id, modified) of each result, which http validators are computed from
+    versions: Tuple[Tuple[int, Optional[datetime]], ...] = ()
 
 
 # ------------------------------------------------------------------------------------------------
@@ -61,32 +186,109 @@ MAX_INSERT_ATTEMPTS = 10
 # ------------------------------------------------------------------------------------------------
 
 
-@log_calls(logger)
-@timed_cache(seconds=CACHE_TIMEOUT_SECONDS)
-def get_summary_of_netflix_titles() -> Dict:
-    query_result = {}
-
-    session = Session()
+@trace_calls(logger)
+def get_summary_of_netflix_titles(session: Optional[Session] = None) -> Dict:
+    """
+    Reads the materialized summary snapshot, building it first if it has never been refreshed.
+    """
+    summary, _ = get_summary_snapshot(session=session)
+    return summary
 
-    query_result["directors"] = session.query(Director).distinct(Director.name).count()
 
-    query_result["cast_members"] = session.query(CastMember).distinct(CastMember.name).count()
+@trace_calls(logger)
+def get_summary_snapshot(session: Optional[Session] = None) -> Tuple[Dict, datetime]:
+    """
+    Reads the materialized summary snapshot together with when it was built, building it first if
+    it has never been refreshed.
+    """
+    with session_scope(session) as session:
+        snapshot = session.query(SummarySnapshot).get(SUMMARY_SNAPSHOT_ID)
+        if snapshot is None or snapshot.summary is None:
+            refresh_summary_snapshot(force=True, session=session)
+            # the refresh doesn't synchronize the session, whose copy is stale when sessions
+            # aren't expired on commit, as in async mode
+            snapshot = (
+                session.query(SummarySnapshot).populate_existing().get(SUMMARY_SNAPSHOT_ID)
+            )
+        return snapshot.summary, snapshot.refreshed
 
-    titles_query = new_query_on_all_columns(session, NetflixTitle)
 
-    query_result["titles"] = titles_query.count()
+@trace_calls(logger)
+def refresh_summary_snapshot(
+    force: bool = False, session: Optional[Session] = None
+) -> Optional[Dict]:
+    """
+    Rebuilds the summary snapshot if it has been marked dirty by a write, or unconditionally if
+    'force' is set. Returns the new summary, or None if the snapshot was already up to date.
+    """
+    with session_scope(session) as session:
+        try:
+            # claim the refresh by clearing the dirty flag first, so that writes landing while the
+            # summary is computed mark it dirty again instead of being lost
+            claimed = (
+                session.query(SummarySnapshot)
+                .filter(SummarySnapshot.id == SUMMARY_SNAPSHOT_ID, SummarySnapshot.dirty == True)
+                .update({"dirty": False}, synchronize_session=False)
+            )
+            session.commit()
+            if not claimed and not force:
+                return None
 
-    movies = titles_query.filter(NetflixTitle.title_type == TitleTypeEnum.movie)
-    query_result["movies"] = _get_query_statistics(movies)
+            summary = _compute_summary(session)
+            # leaves the dirty flag alone, a write may have set it again since it was claimed
+            refreshed = (
+                session.query(SummarySnapshot)
+                .filter(SummarySnapshot.id == SUMMARY_SNAPSHOT_ID)
+                .update(
+                    {"summary": summary, "refreshed": datetime.now()}, synchronize_session=False
+                )
+            )
+            if not refreshed:
+                session.add(
+                    SummarySnapshot(
+                        id=SUMMARY_SNAPSHOT_ID,
+                        summary=summary,
+                        dirty=False,
+                        refreshed=datetime.now(),
+                    )
+                )
+            session.commit()
+            return summary
+        except Exception as e:
+            session.rollback()
+            try:
+                # the claim was committed, so hand the refresh back to the next attempt
+                _mark_summary_dirty(session)
+                session.commit()
+            except Exception as mark_error:
+                session.rollback()
+                logger.error(
+                    "Suppressing error %r while marking summary snapshot dirty." % mark_error
+                )
+            raise e
+
+
+def start_summary_refresher(interval_seconds: int = SUMMARY_REFRESH_SECONDS) -> threading.Thread:
+    """
+    Starts a daemon thread that refreshes the summary snapshot every 'interval_seconds' when it
+    has been marked dirty.
+    """
 
-    shows = titles_query.filter(NetflixTitle.title_type == TitleTypeEnum.tv_show)
-    query_result["shows"] = _get_query_statistics(shows)
+    def _refresh_forever():
+        while True:
+            try:
+                refresh_summary_snapshot()
+            except Exception as e:
+                logger.error("Suppressing error %r while refreshing summary snapshot." % e)
+            time.sleep(interval_seconds)
 
-    return query_result
+    thread = threading.Thread(target=_refresh_forever, name="summary-refresher", daemon=True)
+    thread.start()
+    return thread
 
 
-@log_calls(logger)
-@timed_cache(seconds=CACHE_TIMEOUT_SECONDS)
+@trace_calls(logger)
+@_query_cache("session")
 def get_netflix_titles(
     page: int,
     perpage: int,
@@ -99,92 +301,274 @@ def get_netflix_titles(
     cast_member: Optional[FilterParam] = None,
     director: Optional[FilterParam] = None,
     release_year: Optional[FilterParam] = None,
-) -> List[Dict]:
+    cursor: Optional[Tuple] = None,
+    headline: bool = False,
+    count: Optional[CountMode] = None,
+    session: Optional[Session] = None,
+) -> NetflixTitlesPage:
+    """
+    Returns a page of netflix titles. Pages are selected by 'page' number, unless a 'cursor' from
+    a previous page is passed, in which case the titles after that cursor are returned.
 
-    session = Session()
+    'search' is parsed like a web search, see postgres' websearch_to_tsquery. Searched titles can
+    be ordered by 'relevance', and with 'headline' each title gets a snippet of its description
+    with the matching words highlighted.
 
-    query_results = _query_results(
-        session,
-        page,
-        perpage,
-        order_by,
-        search,
+    'count' adds the total number of matching titles to the page, see 'CountMode'.
+
+    Pages are cached whole, the rows and counts they are assembled from are not cached apart.
+    """
+
+    with session_scope(session) as session:
+        query_results = _query_results(
+            session,
+            page,
+            perpage,
+            order_by,
+            search,
+            genre,
+            country,
+            cast_member,
+            director,
+            release_year,
+            cursor,
+            headline,
+            _projected_fields(include, exclude),
+        )
+
+        total = None
+        if count is not None:
+            total = _count_titles(
+                session,
+                search,
+                genre,
+                country,
+                cast_member,
+                director,
+                release_year,
+                approximate=count == CountMode.APPROXIMATE,
+            )
+
+        if headline and include is not None:
+            # the snippet was asked for, so it is kept along with the included fields
+            include = frozenset(include) | {HEADLINE_KEY}
+        return query_results._replace(
+            results=_filter_columns(query_results.results, include, exclude), total=total
+        )
+
+
+def export_netflix_titles(
+    include: Optional[FrozenSet[str]] = None,
+    exclude: Optional[FrozenSet[str]] = None,
+    search: Optional[Tuple[str]] = None,
+    genre: Optional[FilterParam] = None,
+    country: Optional[FilterParam] = None,
+    cast_member: Optional[FilterParam] = None,
+    director: Optional[FilterParam] = None,
+    release_year: Optional[FilterParam] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    session: Optional[Session] = None,
+) -> Iterator[List[Dict]]:
+    """
+    Yields every netflix title matching the filters, in batches of up to 'batch_size' titles
+    ordered by id. Titles are read through a server side cursor, so only one batch is held in
+    memory at a time. Results are not cached.
+    """
+    with session_scope(session) as session:
+        statement = export_query(
+            session, include, exclude, search, genre, country, cast_member, director, release_year
+        ).statement
+        result = session.execute(
+            statement, execution_options={"stream_results": True, "max_row_buffer": batch_size}
+        )
+        try:
+            for rows in result.partitions(batch_size):
+                yield export_batch(rows, include, exclude)
+        finally:
+            result.close()
+
+
+def export_query(
+    session: Session,
+    include: Optional[FrozenSet[str]],
+    exclude: Optional[FrozenSet[str]],
+    search: Optional[Tuple[str]],
+    genre: Optional[FilterParam],
+    country: Optional[FilterParam],
+    cast_member: Optional[FilterParam],
+    director: Optional[FilterParam],
+    release_year: Optional[FilterParam],
+) -> Query:
+    """
+    Query on the titles matching the same filters and fields as 'get_netflix_titles'. It is only
+    built with 'session', not executed, so asyncio sessions can stream it as well.
+    """
+    query = _add_filter_operations_to_query(
+        new_query_on_aggregated_titles(session, _projected_fields(include, exclude)),
         genre,
         country,
         cast_member,
         director,
         release_year,
+        GENRE_ALIASES,
+        COUNTRY_ALIASES,
+        search,
     )
+    return query.order_by(NetflixTitle.id)
 
-    return _filter_columns(query_results, include, exclude)
 
+def export_fields(
+    include: Optional[FrozenSet[str]], exclude: Optional[FrozenSet[str]]
+) -> Tuple[str, ...]:
+    # fields of exported titles, in order
+    fields = _projected_fields(include, exclude)
+    return tuple(field for field in _TITLE_FIELDS if fields is None or field in fields)
 
-@log_calls(logger)
-@timed_cache(seconds=CACHE_TIMEOUT_SECONDS)
-def get_netflix_title_by_id(id: int) -> Optional[Dict]:
 
-    query = new_query_on_all_columns(Session(), NetflixTitle)
+def export_batch(
+    rows, include: Optional[FrozenSet[str]], exclude: Optional[FrozenSet[str]]
+) -> List[Dict]:
+    return _filter_columns([_title_row_to_dict(row) for row in rows], include, exclude)
 
-    title_obj = query.filter(NetflixTitle.id == id).first()
 
-    if title_obj:
-        return title_obj.to_dict()
-    return None
+@trace_calls(logger)
+@_query_cache("session")
+def get_netflix_title_by_id(id: int, session: Optional[Session] = None) -> Optional[Dict]:
 
+    with session_scope(session) as session:
+        query = new_query_on_aggregated_titles(session)
 
-@log_calls(logger)
-def create_new_netflix_title(title_data: Dict, max_attempts=MAX_INSERT_ATTEMPTS) -> Optional[Dict]:
-    session = Session()
+        row = query.filter(NetflixTitle.id == id).first()
 
-    def _new_model_instance() -> NetflixTitle:
-        nonlocal title_data
-        nonlocal session
-        return NetflixTitle(**_get_orm_objects_for_netflix_title(title_data, session))
+        if row:
+            return _title_row_to_dict(row)
+        return None
 
-    model = retry_insert(session, _new_model_instance, max_attempts)
-    return model.to_dict()
 
+@trace_calls(logger)
+def create_new_netflix_title(
+    title_data: Dict, session: Optional[Session] = None
+) -> Optional[Dict]:
+    with session_scope(session) as session:
+        try:
+            model = NetflixTitle(**_get_orm_objects_for_netflix_title(title_data, session))
+            session.add(model)
+            # allocates the id, see netflix_show_api.db.ids
+            session.flush()
+            _record_title_write(session, model.id)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error("Suppressing error %r in insert of new netflix title." % e)
+            return None
+        _invalidate_locally(model.id)
+        return model.to_dict()
 
-@log_calls(logger)
-def update_netflix_title(id: int, title_data: Dict) -> Optional[Dict]:
-    session = Session()
-    query = new_query_on_all_columns(session, NetflixTitle)
 
-    title_obj = query.filter(NetflixTitle.id == id).first()
+class BulkCreateResult(NamedTuple):
+    # position of the title in the request
+    index: int
+    netflix_title: Optional[Dict] = None
+    error: Optional[str] = None
 
-    if title_obj is None:
-        return None
 
-    try:
-        orm_objects: Dict = _get_orm_objects_for_netflix_title(title_data, session)
-        for attribute, value in orm_objects.items():
-            setattr(title_obj, attribute, value)
-        session.commit()
-        return title_obj.to_dict()
-    except Exception as e:
-        session.rollback()
-        raise e
+@trace_calls(logger)
+def create_new_netflix_titles(
+    titles_data: List[Dict], session: Optional[Session] = None
+) -> Optional[List[BulkCreateResult]]:
+    """
+    Creates many netflix titles in one transaction. Related names are de-duplicated across the
+    batch and resolved with one query per related table, and titles, names and association rows
+    are each inserted with one statement per table, so the number of statements does not grow
+    with the size of the batch. Titles that fail validation get an error result and are skipped,
+    while a database error fails the whole batch and returns None.
+    """
+    results: List[Optional[BulkCreateResult]] = [None] * len(titles_data)
+    indexes, parsed = [], []
+    for index, title_data in enumerate(titles_data):
+        try:
+            parsed.append(_parse_title_data(title_data))
+            indexes.append(index)
+        except ValueError as e:
+            results[index] = BulkCreateResult(index=index, error=str(e))
+
+    now = datetime.now()
+    title_ids: List[int] = []
+    if parsed:
+        with session_scope(session) as session:
+            try:
+                title_ids = _bulk_insert_titles(session, parsed, now)
+                _mark_summary_dirty(session)
+                invalidation.publish_many(
+                    session,
+                    [
+                        invalidation.InvalidationEvent(title_id=id, lists_dirty=True)
+                        for id in title_ids
+                    ],
+                )
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error("Suppressing error %r in bulk insert of new netflix titles." % e)
+                return None
+        for id in title_ids:
+            _invalidate_locally(id)
+
+    for (index, id, (columns, related)) in zip(indexes, title_ids, parsed):
+        results[index] = BulkCreateResult(
+            index=index, netflix_title=_parsed_title_to_dict(id, now, columns, related)
+        )
+    return results
+
+
+@trace_calls(logger)
+def update_netflix_title(
+    id: int, title_data: Dict, session: Optional[Session] = None
+) -> Optional[Dict]:
+    with session_scope(session) as session:
+        query = new_query_on_all_columns(session, NetflixTitle)
 
+        title_obj = query.filter(NetflixTitle.id == id).first()
 
-@log_calls(logger)
-def delete_netflix_title_by_id(id: int) -> Optional[Dict]:
+        if title_obj is None:
+            return None
+
+        try:
+            orm_objects: Dict = _get_orm_objects_for_netflix_title(title_data, session)
+            for attribute, value in orm_objects.items():
+                setattr(title_obj, attribute, value)
+            # relationship changes alone don't update the row, but they change the title's etag
+            title_obj.modified = datetime.now()
+            _record_title_write(session, id)
+            session.commit()
+            _invalidate_locally(id)
+            return title_obj.to_dict()
+        except Exception as e:
+            session.rollback()
+            raise e
+
+
+@trace_calls(logger)
+def delete_netflix_title_by_id(id: int, session: Optional[Session] = None) -> Optional[Dict]:
     """
     Performs a soft delete on netflix title with the given id.
     """
-    session = Session()
-    query = new_query_on_all_columns(session, NetflixTitle)
+    with session_scope(session) as session:
+        query = new_query_on_all_columns(session, NetflixTitle)
 
-    title_obj = query.filter(NetflixTitle.id == id).first()
+        title_obj = query.filter(NetflixTitle.id == id).first()
 
-    if title_obj is None:
-        return None
-    try:
-        title_obj.deleted = datetime.now()
-        session.commit()
-        return title_obj.to_dict()
-    except Exception as e:
-        session.rollback()
-        raise e
+        if title_obj is None:
+            return None
+        try:
+            title_obj.deleted = datetime.now()
+            _record_title_write(session, id)
+            session.commit()
+            _invalidate_locally(id)
+            return title_obj.to_dict()
+        except Exception as e:
+            session.rollback()
+            raise e
 
 
 # ------------------------------------------------------------------------------------------------
@@ -194,22 +578,190 @@ def delete_netflix_title_by_id(id: int) -> Optional[Dict]:
 # ------------------------------------------------------------------------------------------------
 
 
+def _record_title_write(session: Session, id: int):
+    """
+    Marks the summary snapshot dirty and notifies every worker to drop cached results for the
+    title, as part of the write's transaction.
+    """
+    _mark_summary_dirty(session)
+    invalidation.publish(session, invalidation.InvalidationEvent(title_id=id, lists_dirty=True))
+
+
+def _invalidate_locally(id: int):
+    # the listener thread evicts too once the notification arrives, but evicting right away lets
+    # this worker read its own writes
+    invalidation.dispatch(invalidation.InvalidationEvent(title_id=id, lists_dirty=True))
+
+
+@invalidation.on_invalidation
+def _evict_cached_queries(event: invalidation.InvalidationEvent):
+    if event.title_id is not None:
+        get_netflix_title_by_id.cache_evict(event.title_id)
+    if event.lists_dirty:
+        get_netflix_titles.cache_clear()
+
+
+def _mark_summary_dirty(session: Session):
+    # only touch the row when it is clean, to avoid contending on it with every write
+    session.query(SummarySnapshot).filter(
+        SummarySnapshot.id == SUMMARY_SNAPSHOT_ID, SummarySnapshot.dirty == False
+    ).update({"dirty": True}, synchronize_session=False)
+
+
 def new_query_on_all_columns(session: Session, model: Base):
     query = session.query(model)
     # exclude items that have been soft deleted
     return query.filter(model.deleted == None)
 
 
-def get_object_by_name(model: Base, name: str) -> Optional[Base]:
-    session = Session()
-    try:
-        return session.query(model).filter(model.name == name).first()
-    except AttributeError as e:
-        logger.error("Suppressing exception %r" % e)
-        raise ValueError("Model passed to 'get_object_by_name' must have a 'name' column.")
+_TITLE_COLUMNS = (
+    NetflixTitle.id,
+    NetflixTitle.created,
+    NetflixTitle.modified,
+    NetflixTitle.deleted,
+    NetflixTitle.netflix_show_id,
+    NetflixTitle.title_type,
+    NetflixTitle.title,
+    NetflixTitle.netflix_date_added,
+    NetflixTitle.release_year,
+    NetflixTitle.rating,
+    NetflixTitle.duration,
+    NetflixTitle.duration_units,
+    NetflixTitle.description,
+)
+
+
+_TITLE_COLUMN_KEYS = frozenset(column.key for column in _TITLE_COLUMNS)
+
+
+# (label, related model, association column referencing the related model, association column
+# referencing the netflix title)
+_RELATED_NAME_COLUMNS = (
+    (
+        "director",
+        Director,
+        DirectorNetflixTitle.director_id,
+        DirectorNetflixTitle.netflix_title_id,
+    ),
+    (
+        "cast_members",
+        CastMember,
+        CastMemberNetflixTitle.cast_member_id,
+        CastMemberNetflixTitle.netflix_title_id,
+    ),
+    ("countries", Country, CountryNetflixTitle.country_id, CountryNetflixTitle.netflix_title_id),
+    ("genres", Genre, GenreNetflixTitle.genre_id, GenreNetflixTitle.netflix_title_id),
+)
+
+
+def _aggregated_names(model: Base, related_id, netflix_title_id):
+    # correlated subquery collecting the names of every related object into an array
+    return (
+        select(func.array_agg(cast(model.name, TEXT)))
+        .where(model.id == related_id)
+        .where(netflix_title_id == NetflixTitle.id)
+        .scalar_subquery()
+    )
+
+
+def new_query_on_aggregated_titles(
+    session: Session, fields: Optional[FrozenSet[str]] = None
+) -> Query:
+    """
+    Queries netflix title columns together with the names of related directors, cast members,
+    countries and genres, so that a page of titles is loaded in a single statement instead of
+    lazy loading each relationship per title.
+
+    If 'fields' is passed only those columns and relationships are selected, plus the id.
+    """
+    if fields is not None:
+        fields = fields | {"id"}
+    columns = (column for column in _TITLE_COLUMNS if fields is None or column.key in fields)
+    related_names = (
+        _aggregated_names(model, related_id, netflix_title_id).label(label)
+        for (label, model, related_id, netflix_title_id) in _RELATED_NAME_COLUMNS
+        if fields is None or label in fields
+    )
+    query = session.query(*columns, *related_names)
+    # exclude items that have been soft deleted
+    return query.filter(NetflixTitle.deleted == None)
+
+
+def _enum_name(v) -> str:
+    return str(v).split(".")[-1]
+
+
+def _names(names: Optional[List[str]]) -> List[str]:
+    return [name for name in names or () if name]
+
+
+# fields of NetflixTitle.to_dict, in order
+_TITLE_FIELDS = (
+    "id",
+    "created",
+    "modified",
+    "deleted",
+    "netflix_show_id",
+    "title_type",
+    "title",
+    "director",
+    "cast_members",
+    "countries",
+    "netflix_date_added",
+    "release_year",
+    "rating",
+    "duration",
+    "duration_units",
+    "genres",
+    "description",
+)
+
+
+_TITLE_FIELD_CONVERTERS = {
+    "title_type": _enum_name,
+    "director": _names,
+    "cast_members": _names,
+    "countries": _names,
+    "rating": _enum_name,
+    "duration_units": _enum_name,
+    "genres": _names,
+}
+
+
+def _title_row_to_dict(row) -> Dict:
+    """
+    Converts a row from 'new_query_on_aggregated_titles' to the same shape as NetflixTitle.to_dict,
+    limited to the fields the row was queried with.
+    """
+    selected = set(row._fields)
+    return {
+        field: _TITLE_FIELD_CONVERTERS.get(field, identity)(getattr(row, field))
+        for field in _TITLE_FIELDS
+        if field in selected
+    }
+
+
+def _projected_fields(
+    include: Optional[FrozenSet[str]], exclude: Optional[FrozenSet[str]]
+) -> Optional[FrozenSet[str]]:
+    # the fields to select for 'include' and 'exclude', None to select all of them
+    if include is None and exclude is None:
+        return None
+    fields = frozenset(_TITLE_FIELDS) if include is None else frozenset(include)
+    return fields - (exclude or frozenset())
+
+
+def get_object_by_name(
+    model: Base, name: str, session: Optional[Session] = None
+) -> Optional[Base]:
+    with session_scope(session) as session:
+        try:
+            return session.query(model).filter(model.name == name).first()
+        except AttributeError as e:
+            logger.error("Suppressing exception %r" % e)
+            raise ValueError("Model passed to 'get_object_by_name' must have a 'name' column.")
 
 
-@timed_cache(seconds=CACHE_TIMEOUT_SECONDS)
 def _query_results(
     session: Session,
     page: int,
@@ -221,16 +773,37 @@ def _query_results(
     cast_member: Optional[FilterParam],
     director: Optional[FilterParam],
     release_year: Optional[FilterParam],
+    cursor: Optional[Tuple] = None,
+    headline: bool = False,
+    fields: Optional[FrozenSet[str]] = None,
     genre_aliases: Tuple[Tuple[str]] = GENRE_ALIASES,
     country_aliases: Tuple[Tuple[str]] = COUNTRY_ALIASES,
-) -> List[Dict]:
+) -> NetflixTitlesPage:
 
     genre_aliases = dict(genre_aliases)
 
-    query = new_query_on_all_columns(session, NetflixTitle)
+    # ranks that can be sorted on by name, higher is better
+    ranks = {}
+
+    similarity_rank = _similarity_rank(cast_member, director)
+    if similarity_rank is not None:
+        ranks[SIMILARITY_SORT_KEY] = similarity_rank
+        # titles matched by similarity come best match first, unless another order is requested
+        if not order_by:
+            order_by = (OrderByParam(SIMILARITY_SORT_KEY, False),)
+
+    if search:
+        ts_query = _search_query(search)
+        ranks[RELEVANCE_SORT_KEY] = _relevance_rank(ts_query)
+
+    sort_keys = _sort_keys(order_by, ranks)
+
+    if fields is not None:
+        # sort columns are needed to encode cursors, and modification times for validators
+        fields = fields | {column.key for (column, _) in sort_keys} | {"modified"}
+    query = new_query_on_aggregated_titles(session, fields)
 
     query = _add_filter_operations_to_query(
-        session,
         query,
         genre,
         country,
@@ -239,26 +812,197 @@ def _query_results(
         release_year,
         genre_aliases,
         country_aliases,
+        search,
     )
 
-    if search:
-        search_str = "+".join(search)
-        query = _add_search_filter(query, search_str)
-
-    if order_by:
-        for param in order_by:
-            column = getattr(NetflixTitle, param.field, None)
-            if column is None:
-                continue
-            if param.descending:
-                column = column.desc()
-            query = query.order_by(column)
-
-    page_range = slice(
-        (page - 1) * perpage,
-        (page) * perpage,
+    if search and headline:
+        query = query.add_columns(_headline(ts_query))
+    query = query.add_columns(*(column for (column, _) in sort_keys if column.key in ranks))
+
+    query = query.order_by(*(column.desc() if desc else column for (column, desc) in sort_keys))
+
+    # fetch one title past the page to tell whether there is a next page
+    if cursor is not None:
+        query = query.filter(_after_cursor(sort_keys, cursor))
+        rows = query.limit(perpage + 1).all()
+    else:
+        page_range = slice(
+            (page - 1) * perpage,
+            (page) * perpage + 1,
+        )
+        rows = query[page_range]
+
+    has_next = len(rows) > perpage
+    rows = rows[:perpage]
+
+    next_cursor = None
+    if has_next:
+        next_cursor = _encode_cursor(sort_keys, rows[-1])
+
+    results = [_title_row_to_dict(row) for row in rows]
+    if search and headline:
+        for (result, row) in zip(results, rows):
+            result[HEADLINE_KEY] = getattr(row, HEADLINE_KEY)
+
+    versions = tuple((result["id"], result["modified"]) for result in results)
+    return NetflixTitlesPage(results, next_cursor, has_next, versions=versions)
+
+
+def _count_titles(
+    session: Session,
+    search: Tuple[str],
+    genre: Optional[FilterParam],
+    country: Optional[FilterParam],
+    cast_member: Optional[FilterParam],
+    director: Optional[FilterParam],
+    release_year: Optional[FilterParam],
+    approximate: bool = False,
+    genre_aliases: Tuple[Tuple[str]] = GENRE_ALIASES,
+    country_aliases: Tuple[Tuple[str]] = COUNTRY_ALIASES,
+) -> int:
+    """
+    Counts the titles matching the same filters as '_query_results'. Approximate counts are the
+    planner's estimate of the rows the filtered query returns, so they are as accurate as the
+    table statistics but never scan the titles.
+    """
+    query = session.query(NetflixTitle.id).filter(NetflixTitle.deleted == None)
+    query = _add_filter_operations_to_query(
+        query,
+        genre,
+        country,
+        cast_member,
+        director,
+        release_year,
+        genre_aliases,
+        country_aliases,
+        search,
     )
-    return [obj.to_dict() for obj in query[page_range]]
+    if approximate:
+        return _estimate_rows(session, query)
+    return query.order_by(None).count()
+
+
+class _Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(_Explain, "postgresql")
+def _compile_explain(element, compiler, **kwargs):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kwargs)
+
+
+def _estimate_rows(session: Session, query: Query) -> int:
+    plans = session.connection().execute(_Explain(query.statement)).scalar()
+    # psycopg2 parses the json plan, other drivers return it as text
+    if isinstance(plans, str):
+        plans = json.loads(plans)
+    return int(plans[0]["Plan"]["Plan Rows"])
+
+
+# ------------------------------------------------------------------------------------------------
+# KEYSET PAGINATION
+# ------------------------------------------------------------------------------------------------
+
+
+def _sort_keys(
+    order_by: Optional[OrderByParam], ranks: Optional[Dict[str, Any]] = None
+) -> List[Tuple[Any, bool]]:
+    """
+    Returns (column, descending) pairs to sort on, with the primary key as the final tiebreaker so
+    that every row has a unique position to resume pagination from.
+
+    'ranks' maps names to labeled rank expressions, which sort best first unless descending.
+    """
+    ranks = ranks or {}
+    sort_keys = []
+    for param in order_by or ():
+        if param.field in ranks:
+            sort_keys.append((ranks[param.field], not param.descending))
+            continue
+        column = NetflixTitle.__table__.columns.get(param.field)
+        if column is None or column.key not in _TITLE_COLUMN_KEYS:
+            continue
+        sort_keys.append((column, param.descending))
+        if column.primary_key:
+            return sort_keys
+    sort_keys.append((NetflixTitle.__table__.columns.id, False))
+    return sort_keys
+
+
+def _sort_signature(sort_keys: List[Tuple[Any, bool]]) -> str:
+    return ",".join(f"{column.key}:desc" if desc else column.key for (column, desc) in sort_keys)
+
+
+def _encode_cursor_value(value) -> Any:
+    if isinstance(value, Enum):
+        return value.name
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _decode_cursor_value(column, value) -> Any:
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if issubclass(python_type, Enum):
+        return python_type[value]
+    if issubclass(python_type, (date, datetime)):
+        return python_type.fromisoformat(value)
+    return python_type(value)
+
+
+def _encode_cursor(sort_keys: List[Tuple[Any, bool]], row) -> str:
+    values = (_encode_cursor_value(getattr(row, column.key)) for (column, _) in sort_keys)
+    return encode_cursor((_sort_signature(sort_keys), *values))
+
+
+def _after_cursor(sort_keys: List[Tuple[Any, bool]], cursor: Tuple):
+    """
+    Builds a filter on the rows that sort strictly after the row encoded in 'cursor'.
+
+    When every sort key is non null and sorted in the same direction, e.g. the default order by
+    id, the filter is a row comparison, which postgres can seek an index on straight to the next
+    page. Otherwise it is expanded into an OR of ANDs, to place nulls and mixed directions right.
+    No index serves those orders, so deep pages still read and sort every row before the cursor,
+    though without an OFFSET's cost of returning them.
+    """
+    signature, *values = cursor
+    if signature != _sort_signature(sort_keys) or len(values) != len(sort_keys):
+        raise InvalidCursorError("Cursor does not match the requested 'order_by'.")
+    try:
+        values = [_decode_cursor_value(column, v) for ((column, _), v) in zip(sort_keys, values)]
+    except (KeyError, TypeError, ValueError):
+        raise InvalidCursorError("Cursor contains invalid values.")
+
+    directions = {descending for (_, descending) in sort_keys}
+    if len(directions) == 1 and not any(
+        getattr(column, "nullable", False) for (column, _) in sort_keys
+    ):
+        columns = tuple_(*(column for (column, _) in sort_keys))
+        return columns < tuple_(*values) if directions.pop() else columns > tuple_(*values)
+
+    clauses = []
+    equal_so_far = []
+    for (column, descending), value in zip(sort_keys, values):
+        clauses.append(and_(*equal_so_far, _after_value(column, descending, value)))
+        equal_so_far.append(column == value)
+    return or_(*clauses)
+
+
+def _after_value(column, descending: bool, value):
+    # postgres sorts nulls last in ascending order and first in descending order
+    if descending:
+        return column != None if value is None else column < value
+    if value is None:
+        return false()
+    # rank labels have no 'nullable', ranks are never null for the titles they filter on
+    if getattr(column, "nullable", False):
+        return or_(column > value, column == None)
+    return column > value
 
 
 def _str_to_enum(s: str, enum: Enum, aliases: Tuple[Tuple[str]]):
@@ -270,7 +1014,6 @@ def _str_to_enum(s: str, enum: Enum, aliases: Tuple[Tuple[str]]):
 
 
 def _add_filter_operations_to_query(
-    session,
     query,
     genre,
     country,
@@ -279,30 +1022,29 @@ def _add_filter_operations_to_query(
     release_year,
     genre_aliases,
     country_aliases,
+    search=None,
 ):
+    # full text search
+    if search:
+        query = _add_search_filter(query, _search_query(search))
+
     # filter on genre
     if genre and genre.operator == FilterOperator.EQUAL:
-        query = _add_filter_on_enum_field(
-            query, genre, GenreEnum, Genre, genre_aliases, NetflixTitle.genres, session
-        )
+        query = _add_filter_on_enum_field(query, genre, GenreEnum, genre_aliases, "genres")
 
     # filter on country
     if country and country.operator == FilterOperator.EQUAL:
         query = _add_filter_on_enum_field(
-            query, country, CountryEnum, Country, country_aliases, NetflixTitle.countries, session
+            query, country, CountryEnum, country_aliases, "countries"
         )
 
     # filter on cast member
-    if cast_member and cast_member.operator in (FilterOperator.EQUAL, FilterOperator.LIKE):
-        query = _filter_on_related_string_field(
-            query, cast_member, CastMember, NetflixTitle.cast_members, session
-        )
+    if cast_member and cast_member.operator in _RELATED_STRING_OPERATORS:
+        query = _filter_on_related_string_field(query, cast_member, "cast_members")
 
     # filter on director
-    if director and director.operator in (FilterOperator.EQUAL, FilterOperator.LIKE):
-        query = _filter_on_related_string_field(
-            query, director, Director, NetflixTitle.director, session
-        )
+    if director and director.operator in _RELATED_STRING_OPERATORS:
+        query = _filter_on_related_string_field(query, director, "director")
 
     # filter on release year
     if release_year and release_year.operator in (
@@ -312,12 +1054,32 @@ def _add_filter_operations_to_query(
         FilterOperator.GREATER_THAN_OR_EQUAL,
         FilterOperator.LESS_THAN_OR_EQUAL,
     ):
-        query = _filter_on_integer_field(query, release_year, NetflixTitle.release_year, session)
+        query = _filter_on_integer_field(query, release_year, NetflixTitle.release_year)
 
     return query
 
 
-def _add_filter_on_enum_field(query, filter_param, enum, model, aliases, relationship, session):
+_RELATED_COLUMNS_BY_LABEL = {label: columns for (label, *columns) in _RELATED_NAME_COLUMNS}
+
+
+def _has_related(label: str, condition):
+    """
+    Correlated EXISTS on the association table for 'label', true for netflix titles related to at
+    least one object matching 'condition'. Postgres runs it as a semi join, so the filter stays in
+    the same statement as the page of titles, and a title is never repeated when it matches more
+    than one related object.
+    """
+    model, related_id, netflix_title_id = _RELATED_COLUMNS_BY_LABEL[label]
+    return (
+        select(related_id)
+        .where(model.id == related_id)
+        .where(netflix_title_id == NetflixTitle.id)
+        .where(condition)
+        .exists()
+    )
+
+
+def _add_filter_on_enum_field(query, filter_param, enum, aliases, label):
     try:
         filter_to = _str_to_enum(filter_param.value, enum, aliases)
     except ValueError as e:
@@ -325,29 +1087,67 @@ def _add_filter_on_enum_field(query, filter_param, enum, model, aliases, relatio
             f'Suppressing error {e} in call to "_str_to_enum" in "_add_filter_on_enum_field".'
         )
         return query
-    child_obj = session.query(model).filter(model.name == filter_to).first()
-    if child_obj:
-        query = query.filter(relationship.contains(child_obj))
-    return query
+    model, _, _ = _RELATED_COLUMNS_BY_LABEL[label]
+    return query.filter(_has_related(label, model.name == filter_to))
 
 
-def _filter_on_related_string_field(query, filter_param, model, relationship, session):
+_RELATED_STRING_OPERATORS = (
+    FilterOperator.EQUAL,
+    FilterOperator.LIKE,
+    FilterOperator.ILIKE,
+    FilterOperator.SIMILAR,
+)
+
+
+def _filter_on_related_string_field(query, filter_param, label):
+    # substring and similarity operators are served by the trigram indexes on the name columns
+    model, _, _ = _RELATED_COLUMNS_BY_LABEL[label]
     if filter_param.operator == FilterOperator.EQUAL:
         filter_query = model.name == filter_param.value
     elif filter_param.operator == FilterOperator.LIKE:
         filter_query = model.name.like(f"%{filter_param.value}%")
+    elif filter_param.operator == FilterOperator.ILIKE:
+        filter_query = model.name.ilike(f"%{filter_param.value}%")
+    elif filter_param.operator == FilterOperator.SIMILAR:
+        filter_query = _similar_name(model, filter_param.value)
     else:
         raise ValueError("Invalid operator {filter_param.operator!r} in filter_param.")
 
-    # accounts for duplicates in the director and cast_member tables
-    # TODO: dedupe the director and cast_member tables
-    child_objs = session.query(model).filter(filter_query).all()
-    if child_objs:
-        query = query.filter(or_(*[relationship.contains(child_obj) for child_obj in child_objs]))
-    return query
+    return query.filter(_has_related(label, filter_query))
+
+
+def _similar_name(model: Base, value: str):
+    # true when 'value' is similar to some run of words in the name, see pg_trgm's '%>' operator
+    # and 'pg_trgm.word_similarity_threshold'
+    return model.name.op("%>")(value)
 
 
-def _filter_on_integer_field(query, filter_param, column, session):
+def _similarity_rank(cast_member: Optional[FilterParam], director: Optional[FilterParam]):
+    """
+    Expression ranking netflix titles by how closely their best matching cast member or director
+    name matches the 'similar' filters, or None if neither filter uses the 'similar' operator.
+    """
+    ranks = []
+    for (label, filter_param) in (("cast_members", cast_member), ("director", director)):
+        if not filter_param or filter_param.operator != FilterOperator.SIMILAR:
+            continue
+        model, related_id, netflix_title_id = _RELATED_COLUMNS_BY_LABEL[label]
+        # word_similarity returns a real, cast so ranks round trip through cursors exactly
+        similarity = cast(func.word_similarity(filter_param.value, model.name), DOUBLE_PRECISION)
+        ranks.append(
+            select(func.max(similarity))
+            .where(model.id == related_id)
+            .where(netflix_title_id == NetflixTitle.id)
+            .where(_similar_name(model, filter_param.value))
+            .scalar_subquery()
+        )
+    if not ranks:
+        return None
+    rank = ranks[0] if len(ranks) == 1 else func.least(*ranks)
+    return rank.label(SIMILARITY_SORT_KEY)
+
+
+def _filter_on_integer_field(query, filter_param, column):
     if filter_param.operator == FilterOperator.EQUAL:
         filter_query = column == filter_param.value
     elif filter_param.operator == FilterOperator.GREATER_THAN:
@@ -375,63 +1175,96 @@ def _filter_columns(query_results, include, exclude):
     ]
 
 
-@log_calls(logger)
-def _add_search_filter(query: Query, search: str) -> Query:
-    return query.filter(NetflixTitle.__ts_vector__.match(search, postgresql_reconfig="english"))
+def _search_query(search: Tuple[str]):
+    return func.websearch_to_tsquery(SEARCH_CONFIG, " ".join(search))
 
 
-def retry_insert(session: Session, new_model: Callable, max_attempts: int) -> Optional[Base]:
-    attempts = 0
-    # retry on primary key collisions
-    while attempts < max_attempts:
-        try:
-            model = new_model()
-            session.add(model)
-            session.commit()
-            return model
-        except Exception:
-            session.rollback()
-            logger.info("Key collision on insert. Retrying.")
-            attempts += 1
-            if attempts >= max_attempts:
-                logger.error("Too many key collisions. Aborting insert and returning None.")
-                return None
+@trace_calls(logger)
+def _add_search_filter(query: Query, ts_query) -> Query:
+    # served by the gin index on the stored search vector
+    return query.filter(NetflixTitle.search_vector.op("@@")(ts_query))
 
 
-def get_existing_by_name_or_create(session, model, name):
-    def _new_model():
-        return model(name=name)
+def _relevance_rank(ts_query):
+    # ts_rank returns a real, cast so ranks round trip through cursors exactly
+    rank = cast(func.ts_rank(NetflixTitle.search_vector, ts_query), DOUBLE_PRECISION)
+    return rank.label(RELEVANCE_SORT_KEY)
 
-    obj = session.query(model).filter(model.name == name).first()
-    if obj is None:
-        obj = retry_insert(session, _new_model, MAX_INSERT_ATTEMPTS)
-        if obj is None:
-            raise ValueError(f"Failed to insert {model!r} instance with name {name!r}")
-    return obj
 
+def _headline(ts_query):
+    # postgres evaluates this after sorting and limiting, so only titles on the page pay for it
+    return func.ts_headline(
+        SEARCH_CONFIG,
+        func.coalesce(NetflixTitle.description, ""),
+        ts_query,
+        HEADLINE_OPTIONS,
+    ).label(HEADLINE_KEY)
 
-def _get_orm_objects_for_netflix_title(title_data: Dict, session: Session) -> Dict:
+
+def upsert_names(session: Session, model: Base, names: Iterable) -> Dict[Any, int]:
+    """
+    Returns the ids of the rows of 'model' with the given names, inserting the missing ones with
+    one INSERT ... ON CONFLICT DO NOTHING RETURNING statement, and reading the ids of the names
+    that already existed with one SELECT. The unique constraint on 'name' makes concurrent writers
+    resolve a name to the same row instead of each creating one.
+    """
+    # sorted, so that concurrent writers inserting the same new names wait on them in one order
+    names = sorted(set(names), key=str)
+    if not names:
+        return {}
+    ids = {name: id for (id, name) in session.execute(_insert_names_statement(model, names))}
+    # existing rows are only read, so writers sharing common names like genres don't lock them
+    existing = [name for name in names if name not in ids]
+    if existing:
+        rows = session.query(model.id, model.name).filter(model.name.in_(existing))
+        ids.update({name: id for (id, name) in rows})
+    return ids
+
+
+def _insert_names_statement(model: Base, names: List):
+    statement = insert(model).values([{"name": name} for name in names])
+    return statement.on_conflict_do_nothing(index_elements=[model.name]).returning(
+        model.id, model.name
+    )
+
+
+def get_existing_by_names_or_create(session: Session, model: Base, names: List) -> List[Base]:
+    """
+    Returns objects of 'model' for 'names', in order, creating any that don't exist yet in the
+    caller's transaction.
+    """
+    ids = upsert_names(session, model, names)
+    if not ids:
+        return []
+    objects = {obj.name: obj for obj in session.query(model).filter(model.id.in_(ids.values()))}
+    return [objects[name] for name in names]
+
+
+def _distinct(values: Iterable[Hashable]) -> List[Hashable]:
+    # association tables are keyed on id pairs, so a title can only be related to an object once
+    return list(dict.fromkeys(values))
+
+
+def _parse_title_data(title_data: Dict) -> Tuple[Dict, Dict[str, List]]:
+    """
+    Splits 'title_data' into netflix title column values and the distinct names of related
+    objects by relationship, converting enum fields. Raises ValueError on invalid enum values.
+    """
     title_type = title_data.get("title_type")
     if title_type:
-        try:
-            title_type = _str_to_enum(title_type, TitleTypeEnum, TITLE_TYPE_ALIASES)
-        except ValueError as e:
-            logger.error(
-                f'Suppressing error {e} in call to "_str_to_enum" in "_add_filter_on_enum_field".'
-            )
+        # postgres would reject the raw string anyway, failing every title written with it
+        title_type = _str_to_enum(title_type, TitleTypeEnum, TITLE_TYPE_ALIASES)
 
-    director = title_data.get("director", [])
-    director = [get_existing_by_name_or_create(session, Director, d) for d in director]
+    director = _distinct(normalize_name(d) for d in title_data.get("director") or [])
+    cast_members = _distinct(normalize_name(cm) for cm in title_data.get("cast_members") or [])
 
-    cast_members = title_data.get("cast_members", [])
-    cast_members = [get_existing_by_name_or_create(session, CastMember, cm) for cm in cast_members]
-    genres = title_data.get("genres", [])
-    genres = (_str_to_enum(genre, GenreEnum, GENRE_ALIASES) for genre in genres)
-    genres = [get_existing_by_name_or_create(session, Genre, g) for g in genres]
+    genres = title_data.get("genres") or []
+    genres = _distinct(_str_to_enum(genre, GenreEnum, GENRE_ALIASES) for genre in genres)
 
-    countries = title_data.get("countries", [])
-    countries = (_str_to_enum(country, CountryEnum, COUNTRY_ALIASES) for country in countries)
-    countries = [get_existing_by_name_or_create(session, Country, c) for c in countries]
+    countries = title_data.get("countries") or []
+    countries = _distinct(
+        _str_to_enum(country, CountryEnum, COUNTRY_ALIASES) for country in countries
+    )
 
     rating = title_data.get("rating")
     if rating:
@@ -441,92 +1274,228 @@ def _get_orm_objects_for_netflix_title(title_data: Dict, session: Session) -> Di
     if duration_units:
         duration_units = _str_to_enum(duration_units, DurationUnitEnum, DURATION_UNIT_ALIASES)
 
-    return dict(
+    columns = dict(
         netflix_show_id=title_data.get("netflix_show_id"),
         title_type=title_type,
         title=title_data.get("title"),
-        director=director,
-        cast_members=cast_members,
-        countries=countries,
         netflix_date_added=title_data.get("netflix_date_added"),
         release_year=title_data.get("release_year"),
         rating=rating,
         duration=title_data.get("duration"),
         duration_units=duration_units,
         description=title_data.get("description"),
+    )
+    related = dict(
+        director=director,
+        cast_members=cast_members,
+        countries=countries,
         genres=genres,
     )
+    return columns, related
+
 
+def _get_orm_objects_for_netflix_title(title_data: Dict, session: Session) -> Dict:
+    columns, related = _parse_title_data(title_data)
+    related_objects = {
+        label: get_existing_by_names_or_create(session, _RELATED_COLUMNS_BY_LABEL[label][0], names)
+        for (label, names) in related.items()
+    }
+    return {**columns, **related_objects}
+
+
+# ------------------------------------------------------------------------------------------------
+# BULK INSERTS
+# ------------------------------------------------------------------------------------------------
 
-def _get_query_statistics(query: Query) -> Dict:
-    stats = {}
-    stats["count"] = query.count()
-    stats["duration"] = _compute_summary_stats(
-        query, NetflixTitle, "duration", count=stats["count"]
+
+def _bulk_insert_titles(
+    session: Session, parsed: List[Tuple[Dict, Dict[str, List]]], now: datetime
+) -> List[int]:
+    """
+    Inserts parsed titles and their relationships with a fixed number of statements, returning
+    the new title ids in order.
+    """
+    ids_by_label = {
+        label: upsert_names(
+            session, model, (name for (_, related) in parsed for name in related[label])
+        )
+        for (label, (model, _, _)) in _RELATED_COLUMNS_BY_LABEL.items()
+    }
+
+    title_ids = reserve_ids(session.connection(), NetflixTitle.__tablename__, len(parsed))
+    session.execute(
+        NetflixTitle.__table__.insert(),
+        [
+            {"id": id, "created": now, "modified": now, **columns}
+            for (id, (columns, _)) in zip(title_ids, parsed)
+        ],
     )
-    stats["ratings"] = _bar_plot(query, "rating")
-    stats["release_year"] = _bar_plot(query, "release_year", str)
-    stats["year_added"] = _bar_plot(query, "netflix_date_added", _get_year_from_datetime)
-    return stats
-
-
-def _compute_summary_stats(query: Query, model: Base, field: str, count=None):
-    if count is None:
-        count = query.count()
-    column = getattr(model, field)
-    null = query.filter(column == None).count()
-    nonnull = count - null
-    query = query.order_by(column)
-    percentile_25_idx = int(0.25 * nonnull)
-    percentile_50_idx = int(0.5 * nonnull)
-    percentile_75_idx = int(0.75 * nonnull)
-    min_ = None
-    percentile_25 = None
-    percentile_50 = None
-    percentile_75 = None
-    max_ = None
-    mean_X = 0  #  E[X]
-    mean_X_squared = 0  # E[X^2]
-    for i, row in enumerate(query):
-        value = getattr(row, field)
-        mean_X += value / nonnull
-        mean_X_squared += value ** 2 / nonnull
-        if i == 0:
-            min_ = value
-        if i == percentile_25_idx:
-            percentile_25 = value
-        if i == percentile_50_idx:
-            percentile_50 = value
-        if i == percentile_75_idx:
-            percentile_75 = value
-        if i == nonnull - 1:
-            max_ = value
-    variance = mean_X_squared - mean_X ** 2
-    std = math.sqrt(variance)
+
+    for (label, (_, related_id, netflix_title_id)) in _RELATED_COLUMNS_BY_LABEL.items():
+        ids = ids_by_label[label]
+        rows = [
+            {
+                "created": now,
+                "modified": now,
+                related_id.key: ids[name],
+                netflix_title_id.key: title_id,
+            }
+            for (title_id, (_, related)) in zip(title_ids, parsed)
+            for name in related[label]
+        ]
+        if rows:
+            session.execute(related_id.table.insert(), rows)
+
+    return title_ids
+
+
+_TitleRow = namedtuple("_TitleRow", _TITLE_FIELDS)
+
+
+def _parsed_title_to_dict(id: int, created: datetime, columns: Dict, related: Dict) -> Dict:
+    # same shape as NetflixTitle.to_dict, without reading the title back
+    names = {
+        label: [name.name if isinstance(name, Enum) else name for name in names]
+        for (label, names) in related.items()
+    }
+    row = _TitleRow(id=id, created=created, modified=created, deleted=None, **columns, **names)
+    return _title_row_to_dict(row)
+
+
+# ------------------------------------------------------------------------------------------------
+# SUMMARY STATISTICS
+# ------------------------------------------------------------------------------------------------
+
+
+_SUMMARY_TITLE_TYPES = (
+    ("movies", TitleTypeEnum.movie),
+    ("shows", TitleTypeEnum.tv_show),
+)
+
+
+def _compute_summary(session: Session) -> Dict:
+    """
+    Computes summary statistics for the netflix titles table. All aggregation happens in postgres,
+    so the cost does not depend on loading titles into python.
+    """
+    query_result = _count_people_and_titles(session)
+
+    summaries = {title_type: {"count": 0} for (_, title_type) in _SUMMARY_TITLE_TYPES}
+    for title_type, duration in _duration_statistics(session):
+        summaries[title_type]["count"] = duration["count"]
+        summaries[title_type]["duration"] = duration
+    for title_type, bar_plots in _bar_plots(session):
+        summaries[title_type].update(bar_plots)
+
+    for key, title_type in _SUMMARY_TITLE_TYPES:
+        query_result[key] = summaries[title_type]
+    return query_result
+
+
+def _count_people_and_titles(session: Session) -> Dict:
+    directors = select(func.count(distinct(Director.name))).scalar_subquery()
+    cast_members = select(func.count(distinct(CastMember.name))).scalar_subquery()
+    titles = (
+        select(func.count()).select_from(NetflixTitle).where(NetflixTitle.deleted == None)
+    ).scalar_subquery()
+    row = session.query(
+        directors.label("directors"),
+        cast_members.label("cast_members"),
+        titles.label("titles"),
+    ).one()
     return {
-        "count": count,
-        "null": null,
-        "mean": mean_X,
-        "std": std,
-        "min": min_,
-        "percentile_25": percentile_25,
-        "percentile_50": percentile_50,
-        "percentile_75": percentile_75,
-        "max": max_,
+        "directors": row.directors,
+        "cast_members": row.cast_members,
+        "titles": row.titles,
     }
 
 
+def _summary_title_query(session: Session, *columns) -> Query:
+    title_types = [title_type for (_, title_type) in _SUMMARY_TITLE_TYPES]
+    query = session.query(NetflixTitle.title_type, *columns)
+    return query.filter(NetflixTitle.deleted == None, NetflixTitle.title_type.in_(title_types))
+
+
+def _as_float(v) -> Optional[float]:
+    return None if v is None else float(v)
+
+
+def _duration_statistics(session: Session) -> List[Tuple[TitleTypeEnum, Dict]]:
+    duration = NetflixTitle.duration
+    query = _summary_title_query(
+        session,
+        func.count().label("count"),
+        func.count().filter(duration == None).label("null"),
+        func.avg(duration).label("mean"),
+        func.stddev_pop(duration).label("std"),
+        func.min(duration).label("min"),
+        func.percentile_disc(0.25).within_group(duration).label("percentile_25"),
+        func.percentile_disc(0.5).within_group(duration).label("percentile_50"),
+        func.percentile_disc(0.75).within_group(duration).label("percentile_75"),
+        func.max(duration).label("max"),
+    ).group_by(NetflixTitle.title_type)
+    return [
+        (
+            row.title_type,
+            {
+                "count": row.count,
+                "null": row.null,
+                "mean": _as_float(row.mean),
+                "std": _as_float(row.std),
+                "min": row.min,
+                "percentile_25": row.percentile_25,
+                "percentile_50": row.percentile_50,
+                "percentile_75": row.percentile_75,
+                "max": row.max,
+            },
+        )
+        for row in query
+    ]
+
+
 def _default_bar_plot_postprocess(v):
     return str(v).split(".")[-1]
 
 
-def _get_year_from_datetime(v):
-    if v is not None:
-        return str(v.year)
-    return "None"
+def _bar_plots(session: Session) -> List[Tuple[TitleTypeEnum, Dict]]:
+    """
+    Counts titles per rating, release year and year added for each title type in one statement,
+    using grouping sets.
+    """
+    rating = NetflixTitle.rating
+    release_year = NetflixTitle.release_year
+    year_added = cast(func.extract("year", NetflixTitle.netflix_date_added), Integer)
+    grouped_columns = (
+        ("ratings", rating),
+        ("release_year", release_year),
+        ("year_added", year_added),
+    )
+    query = _summary_title_query(
+        session,
+        *(column.label(key) for (key, column) in grouped_columns),
+        func.grouping(*(column for (_, column) in grouped_columns)).label("grouping"),
+        func.count().label("count"),
+    ).group_by(
+        func.grouping_sets(
+            *(tuple_(NetflixTitle.title_type, column) for (_, column) in grouped_columns)
+        )
+    )
+
+    return _decode_bar_plots(query, [key for (key, _) in grouped_columns])
 
 
-def _bar_plot(
-    query: Query, field: str, postprocess: Callable = _default_bar_plot_postprocess
-) -> Dict:
-    return dict(Counter((postprocess(getattr(row, field)) for row in query)))
+def _decode_bar_plots(rows, keys: List[str]) -> List[Tuple[TitleTypeEnum, Dict]]:
+    """
+    Splits the rows of the grouping sets query into a bar plot per key and title type. Each row
+    has a column per key, only one of which is part of its grouping set, and a 'grouping' bitmask.
+    """
+    # 'grouping' sets a bit for every argument that is not part of the row's grouping set
+    n = len(keys)
+    grouping_keys = {(2 ** n - 1) ^ (1 << (n - 1 - i)): key for (i, key) in enumerate(keys)}
+
+    bar_plots = {}
+    for row in rows:
+        key = grouping_keys[row.grouping]
+        plots = bar_plots.setdefault(row.title_type, {k: {} for k in keys})
+        plots[key][_default_bar_plot_postprocess(getattr(row, key))] = row.count
+    return list(bar_plots.items())
@@ -7,22 +7,26 @@ from enum import Enum as PythonEnum
 from sqlalchemy import (
     Boolean,
     Column,
+    Computed,
     Date,
     DateTime,
     ForeignKey,
     Index,
     Integer,
+    PrimaryKeyConstraint,
     String,
-    cast,
-    func,
+    UniqueConstraint,
 )
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.types import Enum as SQLAlchemyEnum
 
-from ..utils import camel_to_snake, create_integer_id
+import netflix_show_api.config as config
+
+from ..utils import camel_to_snake
 from .constants import COUNTRIES, DURATION_UNITS, GENRES, RATINGS, TITLE_TYPES
+from .ids import id_default
 
 
 class Base:
@@ -30,7 +34,16 @@ class Base:
     def __tablename__(cls):
         return camel_to_snake(cls.__name__)
 
-    id = Column(Integer, primary_key=True, default=create_integer_id)
+    @declared_attr
+    def id(cls):
+        return Column(
+            Integer,
+            primary_key=True,
+            default=id_default(
+                cls.__tablename__, config.CONFIG.id_strategy, config.CONFIG.id_block_size
+            ),
+        )
+
     created = Column(DateTime, default=datetime.now)
     modified = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     deleted = Column(DateTime, nullable=True)
@@ -93,36 +106,57 @@ GenreEnum = PythonEnum(
 # assosication tables for M-M relationships
 
 
+def _association_table_args(tablename: str, related_id: str):
+    # keyed on the pair of ids instead of a surrogate id. The primary key finds the related
+    # objects of a netflix title, the unique index finds the netflix titles of a related object.
+    return (
+        PrimaryKeyConstraint("netflix_title_id", related_id),
+        Index(f"idx_{tablename}_{related_id}", related_id, "netflix_title_id", unique=True),
+    )
+
+
 class CastMemberNetflixTitle(Base):
 
     # tablename : "cast_member_netflix_title"
 
-    cast_member_id = Column(Integer, ForeignKey("cast_member.id"))
-    netflix_title_id = Column(Integer, ForeignKey("netflix_title.id"))
+    id = None
+    cast_member_id = Column(Integer, ForeignKey("cast_member.id"), nullable=False)
+    netflix_title_id = Column(Integer, ForeignKey("netflix_title.id"), nullable=False)
+
+    __table_args__ = _association_table_args("cast_member_netflix_title", "cast_member_id")
 
 
 class DirectorNetflixTitle(Base):
 
     # tablename : "director_netflix_title"
 
-    director_id = Column(Integer, ForeignKey("director.id"))
-    netflix_title_id = Column(Integer, ForeignKey("netflix_title.id"))
+    id = None
+    director_id = Column(Integer, ForeignKey("director.id"), nullable=False)
+    netflix_title_id = Column(Integer, ForeignKey("netflix_title.id"), nullable=False)
+
+    __table_args__ = _association_table_args("director_netflix_title", "director_id")
 
 
 class CountryNetflixTitle(Base):
 
     # tablename : "country_netflix_title"
 
-    country_id = Column(Integer, ForeignKey("country.id"))
-    netflix_title_id = Column(Integer, ForeignKey("netflix_title.id"))
+    id = None
+    country_id = Column(Integer, ForeignKey("country.id"), nullable=False)
+    netflix_title_id = Column(Integer, ForeignKey("netflix_title.id"), nullable=False)
+
+    __table_args__ = _association_table_args("country_netflix_title", "country_id")
 
 
 class GenreNetflixTitle(Base):
 
     # tablename : "genre_netflix_title"
 
-    genre_id = Column(Integer, ForeignKey("genre.id"))
-    netflix_title_id = Column(Integer, ForeignKey("netflix_title.id"))
+    id = None
+    genre_id = Column(Integer, ForeignKey("genre.id"), nullable=False)
+    netflix_title_id = Column(Integer, ForeignKey("netflix_title.id"), nullable=False)
+
+    __table_args__ = _association_table_args("genre_netflix_title", "genre_id")
 
 
 # normalized tables that represent M-M relationships
@@ -135,6 +169,18 @@ class CastMember(Base):
     name = Column(String(100))
     # netflix_titles : reverse relationship
 
+    __table_args__ = (
+        # lets concurrent writers upsert names without creating duplicates
+        UniqueConstraint(name, name="uq_cast_member_name"),
+        # trigram index for substring and similarity matching on names, requires pg_trgm
+        Index(
+            "idx_cast_member_name_trgm",
+            name,
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+    )
+
     @property
     def repr_params(self):
         return {
@@ -161,6 +207,18 @@ class Director(Base):
     name = Column(String(100))
     # netflix_titles : reverse relationship
 
+    __table_args__ = (
+        # lets concurrent writers upsert names without creating duplicates
+        UniqueConstraint(name, name="uq_director_name"),
+        # trigram index for substring and similarity matching on names, requires pg_trgm
+        Index(
+            "idx_director_name_trgm",
+            name,
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+    )
+
     @property
     def repr_params(self):
         return {
@@ -187,6 +245,8 @@ class Country(Base):
     name = Column(SQLAlchemyEnum(CountryEnum))
     # netflix_titles : reverse relationship
 
+    __table_args__ = (UniqueConstraint(name, name="uq_country_name"),)
+
     @property
     def repr_params(self):
         return {
@@ -213,6 +273,8 @@ class Genre(Base):
     name = Column(SQLAlchemyEnum(GenreEnum))
     # netflix_titles : reverse relationship
 
+    __table_args__ = (UniqueConstraint(name, name="uq_genre_name"),)
+
     @property
     def repr_params(self):
         return {
@@ -235,16 +297,11 @@ class Genre(Base):
 # primary detail table
 
 
-def _create_tsvector(*args):
-    """
-    Helper function for creating a text-search index
-
-    See https://stackoverflow.com/questions/42388956/create-a-full-text-search-index-with-sqlalchemy-on-postgresql/53217555
-    """
-    exp = args[0]
-    for e in args[1:]:
-        exp += " " + e
-    return func.to_tsvector("english", exp)
+# weighted text search document, title matches rank above description matches
+SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+)
 
 
 class NetflixTitle(Base):
@@ -279,14 +336,15 @@ class NetflixTitle(Base):
     )
     description = Column(String(1000), nullable=True)
 
-    # for full text search
-    # see https://stackoverflow.com/questions/42388956/create-a-full-text-search-index-with-sqlalchemy-on-postgresql/53217555
-    __ts_vector__ = _create_tsvector(
-        cast(func.coalesce(title, ""), postgresql.TEXT),
-        cast(func.coalesce(description, ""), postgresql.TEXT),
+    # for full text search, generated by postgres on every write. Deferred since it is only used
+    # in filters and is never returned to clients.
+    search_vector = deferred(
+        Column(postgresql.TSVECTOR, Computed(SEARCH_VECTOR_SQL, persisted=True), nullable=True)
     )
 
-    __table_args__ = (Index("idx_title_fts", __ts_vector__, postgresql_using="gin"),)
+    __table_args__ = (
+        Index("idx_netflix_title_search_vector", search_vector, postgresql_using="gin"),
+    )
 
     @property
     def repr_params(self):
@@ -313,3 +371,30 @@ class NetflixTitle(Base):
             "genres": [str(g) for g in self.genres if str(g)],
             "description": self.description,
         }
+
+
+# materialized summary statistics
+
+
+SUMMARY_SNAPSHOT_ID = 1
+
+
+class SummarySnapshot(Base):
+    """
+    Single row table holding the latest summary statistics of the netflix titles. Writes to
+    netflix titles mark it dirty, and a background refresher rebuilds it.
+    """
+
+    # tablename : "summary_snapshot"
+
+    summary = Column(postgresql.JSONB, nullable=True)
+    dirty = Column(Boolean, nullable=False, default=True)
+    refreshed = Column(DateTime, nullable=True)
+
+    @property
+    def repr_params(self):
+        return {
+            **super().repr_params,
+            "dirty": self.dirty,
+            "refreshed": self.refreshed,
+        }
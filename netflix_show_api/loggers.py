@@ -1,32 +1,171 @@
+"""
+Logging setup and call tracing.
+
+'set_logging_config' reads the yaml logging config, which is passed to 'logging.config.dictConfig'
+apart from two extra sections:
+
+- 'queued_handlers' lists handlers that are run by a background thread. Loggers hand records to
+  them through an unbounded queue, so request threads never wait on the handlers' I/O, and
+  messages are formatted on the background thread.
+- 'call_sampling' sets the fraction of calls that 'trace_calls' records, by qualified function
+  name, with 'default' for functions that are not listed.
+"""
+import atexit
+import json
 import logging.config
+import logging.handlers
+import queue
+import random
+import reprlib
+import time
+from datetime import datetime, timezone
 from functools import wraps
+from typing import Any, Callable, Dict, List
 
 from .config import CONFIG
 from .utils import read_yaml
 
+QUEUED_HANDLERS_KEY = "queued_handlers"
+
+
+CALL_SAMPLING_KEY = "call_sampling"
+
+
+_listeners: List[logging.handlers.QueueListener] = []
+
+
+_sampling_rates: Dict[str, float] = {}
+
 
 def set_logging_config(config_file=CONFIG.logging_config):
     with open(config_file, "r") as f:
         config = read_yaml(f.read())
+    queued_handlers = set(config.pop(QUEUED_HANDLERS_KEY, None) or ())
+    sampling_rates = config.pop(CALL_SAMPLING_KEY, None) or {}
+
+    _stop_listeners()
     logging.config.dictConfig(config)
+    _queue_handlers(queued_handlers, config.get("loggers", {}))
+    _sampling_rates.clear()
+    _sampling_rates.update({name: float(rate) for (name, rate) in sampling_rates.items()})
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # unlike the base class, leave formatting the message to the listener thread. Only the
+        # traceback is rendered here, since it can't outlive the frames it refers to.
+        record = logging.makeLogRecord(record.__dict__)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _queue_handlers(names, logger_names):
+    # swaps every handler named in 'names' for a queue handler feeding a listener thread
+    queue_handlers = {}
+    for logger in [logging.getLogger()] + [logging.getLogger(name) for name in logger_names]:
+        for handler in list(logger.handlers):
+            if handler.name not in names:
+                continue
+            if handler not in queue_handlers:
+                records = queue.SimpleQueue()
+                queue_handlers[handler] = _QueueHandler(records)
+                listener = logging.handlers.QueueListener(
+                    records, handler, respect_handler_level=True
+                )
+                listener.start()
+                _listeners.append(listener)
+            logger.removeHandler(handler)
+            logger.addHandler(queue_handlers[handler])
+
+
+@atexit.register
+def _stop_listeners():
+    # flushes records still in the queues
+    while _listeners:
+        _listeners.pop().stop()
+
+
+# attributes every log record has, anything else was passed in 'extra'
+_RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+
+_repr = reprlib.Repr()
+_repr.maxstring = 200
+_repr.maxother = 200
+
+
+def _json_value(value: Any) -> Any:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    # bounded, so large arguments such as title payloads don't blow up records
+    return _repr.repr(value)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as single line json objects, including any fields passed in 'extra'.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        content = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for (key, value) in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                content[key] = _json_value(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            content["exc_info"] = record.exc_text
+        return json.dumps(content)
+
+
+def _sampled(name: str) -> bool:
+    rate = _sampling_rates.get(name, _sampling_rates.get("default", 1.0))
+    return rate >= 1.0 or random.random() < rate
+
+
+def trace_calls(logger: logging.Logger, level: int = logging.INFO) -> Callable:
+    """
+    Records calls to the decorated function with their arguments and duration. Does nothing
+    beyond a level check for calls that are not logged or not sampled, see 'call_sampling', and
+    leaves formatting the arguments to the handler.
+    """
 
+    def decorator(f: Callable) -> Callable:
+        name = f"{f.__module__}.{f.__qualname__}"
 
-def log_calls(logger):
-    def decorator(f):
         @wraps(f)
         def inner(*args, **kwargs):
-            def _caller(*args_, **kwargs_):
-                logger.info("Calling %r\n\targs: %r\n\tkwargs: %r" % (f.__name__, args, kwargs))
-                yield f(*args, **kwargs)
-                logger.info("Exited call to %r" % f.__name__)
-                yield
-
-            caller = _caller(*args, **kwargs)
-            # call decorated function
-            value = next(caller)
-            # reset and log exit event
-            next(caller)
-            return value
+            if not logger.isEnabledFor(level) or not _sampled(name):
+                return f(*args, **kwargs)
+            start = time.perf_counter()
+            outcome = "raised"
+            try:
+                value = f(*args, **kwargs)
+                outcome = "returned"
+                return value
+            finally:
+                duration_ms = (time.perf_counter() - start) * 1000
+                logger.log(
+                    level,
+                    "Call to %s %s after %.2f ms",
+                    name,
+                    outcome,
+                    duration_ms,
+                    extra={
+                        "call": name,
+                        "outcome": outcome,
+                        "duration_ms": duration_ms,
+                        "call_args": args,
+                        "call_kwargs": kwargs,
+                    },
+                )
 
         return inner
 
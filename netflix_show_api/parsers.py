@@ -2,9 +2,12 @@
 Functions for converting between sqlalchemy and pydantic data representations.
 """
 
+import base64
+import binascii
+import json
 import re
 from enum import Enum
-from typing import Any, Callable, FrozenSet, List, NamedTuple, Optional, Tuple
+from typing import Any, Callable, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple
 
 
 def parse_delimited(fields: Optional[str], delim=",") -> Optional[FrozenSet[str]]:
@@ -37,7 +40,8 @@ def parse_order_by(
     return tuple(params)
 
 
-_SEARCH_VALIDATION_REGEX = re.compile(r"[+\w\s\d]{1,100}")
+# allows websearch_to_tsquery syntax, i.e. quoted phrases and negated terms
+_SEARCH_VALIDATION_REGEX = re.compile(r'[+\w\s\d"-]{1,100}')
 
 
 # TODO: add more sql injections to catch up front
@@ -79,6 +83,8 @@ FilterOperator = Enum(
 class FilterOperator(Enum):
     EQUAL = "eq"
     LIKE = "like"
+    ILIKE = "ilike"
+    SIMILAR = "similar"
     GREATER_THAN = "gt"
     LESS_THAN = "lt"
     GREATER_THAN_OR_EQUAL = "geq"
@@ -88,6 +94,20 @@ class FilterOperator(Enum):
 _FILTER_OPERATORS = tuple((op.value, op) for op in FilterOperator)
 
 
+class CountMode(str, Enum):
+    # cached count(*) over the filtered titles
+    EXACT = "exact"
+    # the planner's row estimate for the filtered titles, which costs no more than planning
+    APPROXIMATE = "approximate"
+
+
+class ExportFormat(str, Enum):
+    # one json object per line
+    NDJSON = "ndjson"
+    # a header row followed by one row per title, with names joined by ", "
+    CSV = "csv"
+
+
 class FilterParam(NamedTuple):
     operator: FilterOperator
     value: Any
@@ -113,3 +133,28 @@ def parse_filter_parameter(
     if op is None:
         raise ValueError(f"Found Invalid filter operator {op_str!r}")
     return FilterParam(op, postprocess(value_str))
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    Encodes a sequence of json serializable values into an opaque pagination cursor.
+    """
+    payload = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Tuple]:
+    if not cursor:
+        return None
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursorError(f"Invalid cursor {cursor!r}.")
+    if not isinstance(values, list) or not values:
+        raise InvalidCursorError(f"Invalid cursor {cursor!r}.")
+    return tuple(values)
@@ -0,0 +1,22 @@
+"""
+Timing helpers shared by the benchmark scripts, which import it from the scripts directory.
+"""
+import statistics
+import time
+from typing import Callable, List
+
+
+def time_ms(f: Callable[[], None], repeat: int) -> List[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name: str, timings: List[float]):
+    print(
+        f"{name:<40} median {statistics.median(timings):8.2f} ms"
+        f"  min {min(timings):8.2f} ms  max {max(timings):8.2f} ms"
+    )
@@ -0,0 +1,89 @@
+"""
+Times relationship loads through the association tables.
+
+Run it against the same database before and after the migration that keys the association tables
+on id pairs, e.g.
+
+    alembic downgrade 8e2a4c6b1d93 && python scripts/benchmark_relationship_load.py
+    alembic upgrade head && python scripts/benchmark_relationship_load.py
+
+and compare the timings and query plans that are printed.
+"""
+import argparse
+
+from sqlalchemy import func, text
+
+from netflix_show_api.db.queries import Session, new_query_on_aggregated_titles
+from netflix_show_api.db.schema import CastMember, NetflixTitle
+
+from _bench import report, time_ms
+
+RELATIONSHIPS = ("director", "cast_members", "countries", "genres")
+
+
+def explain(session, statement: str, **params):
+    rows = session.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {statement}"), params)
+    for (line,) in rows:
+        print(f"    {line}")
+
+
+def main(sample_size: int, repeat: int):
+    session = Session()
+    try:
+        title_ids = [
+            id
+            for (id,) in session.query(NetflixTitle.id).order_by(func.random()).limit(sample_size)
+        ]
+        cast_member_ids = [
+            id
+            for (id,) in session.query(CastMember.id).order_by(func.random()).limit(sample_size)
+        ]
+
+        def lazy_load_titles():
+            # one statement per relationship per title, as the ORM issues them
+            for id in title_ids:
+                title = session.query(NetflixTitle).get(id)
+                for relationship in RELATIONSHIPS:
+                    getattr(title, relationship)
+            session.expunge_all()
+
+        def lazy_load_cast_member_titles():
+            for id in cast_member_ids:
+                session.query(CastMember).get(id).netflix_titles
+            session.expunge_all()
+
+        def aggregated_page():
+            new_query_on_aggregated_titles(session).filter(NetflixTitle.id.in_(title_ids)).all()
+
+        print(f"{len(title_ids)} titles, {len(cast_member_ids)} cast members, {repeat} repeats")
+        report("title -> related objects (lazy)", time_ms(lazy_load_titles, repeat))
+        report("cast member -> titles (lazy)", time_ms(lazy_load_cast_member_titles, repeat))
+        report("title page with aggregated names", time_ms(aggregated_page, repeat))
+
+        if title_ids and cast_member_ids:
+            print("plan for title -> cast members:")
+            explain(
+                session,
+                "SELECT cast_member.* FROM cast_member JOIN cast_member_netflix_title "
+                "ON cast_member.id = cast_member_netflix_title.cast_member_id "
+                "WHERE cast_member_netflix_title.netflix_title_id = :id",
+                id=title_ids[0],
+            )
+            print("plan for cast member -> titles:")
+            explain(
+                session,
+                "SELECT netflix_title.id FROM netflix_title JOIN cast_member_netflix_title "
+                "ON netflix_title.id = cast_member_netflix_title.netflix_title_id "
+                "WHERE cast_member_netflix_title.cast_member_id = :id",
+                id=cast_member_ids[0],
+            )
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sample-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    main(args.sample_size, args.repeat)
@@ -0,0 +1,105 @@
+"""
+Compares serializing a page of titles through the response model with the fast response mode.
+
+The response model path is the one FastAPI takes for GET /netflix-titles: each result is turned
+into a 'models.NetflixTitle' in the view, then validated against the route's response model,
+encoded and rendered. Both paths must produce the same bytes, which is checked before timing, e.g.
+
+    python scripts/benchmark_serialization.py --perpage 1000
+    python scripts/benchmark_serialization.py --perpage 100 --db
+"""
+import argparse
+import asyncio
+import random
+import statistics
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+import netflix_show_api.api.models as models
+import netflix_show_api.api.serializers as serializers
+
+from _bench import report, time_ms
+
+RESPONSE_FIELD = create_response_field(name="Response", type_=List[models.NetflixTitle])
+
+
+# reused, so that timings don't include starting an event loop
+LOOP = asyncio.new_event_loop()
+
+
+def synthetic_results(count: int) -> List[Dict]:
+    # the shape of queries.get_netflix_titles results, with some missing values and non ascii names
+    random.seed(0)
+    names = ["Pedro Almodóvar", "Bong Joon-ho", "Agnès Varda", "Hayao Miyazaki", "Spike Lee"]
+    results = []
+    for id in range(1, count + 1):
+        created = datetime(2021, 4, 7, 12, 30) + timedelta(seconds=id)
+        results.append(
+            {
+                "id": id,
+                "created": created,
+                "modified": created,
+                "deleted": None,
+                "netflix_show_id": f"s{id}",
+                "title_type": random.choice(["movie", "tv_show"]),
+                "title": f"Title {id} — \"quoted\"",
+                "director": random.sample(names, random.randint(0, 2)),
+                "cast_members": random.sample(names, random.randint(0, 5)),
+                "countries": ["United States"],
+                "netflix_date_added": date(2020, 1, 1) + timedelta(days=id % 365),
+                "release_year": random.choice([None, 1999, 2015, 2020]),
+                "rating": random.choice(["None", "PG-13", "TV-MA"]),
+                "duration": random.randint(1, 200),
+                "duration_units": "minutes",
+                "genres": ["Dramas", "International Movies"],
+                "description": None if id % 7 == 0 else "A description.\n" * 3,
+            }
+        )
+    return results
+
+
+def db_results(perpage: int) -> List[Dict]:
+    from netflix_show_api.db.queries import get_netflix_titles
+
+    return get_netflix_titles(1, perpage).results
+
+
+def response_model_path(results: List[Dict]) -> bytes:
+    # what the view and FastAPI do for a route with 'response_model_exclude_none=True'
+    content = [models.NetflixTitle(**result) for result in results]
+    encoded = LOOP.run_until_complete(
+        serialize_response(field=RESPONSE_FIELD, response_content=content, exclude_none=True)
+    )
+    return JSONResponse(encoded).body
+
+
+def fast_path(results: List[Dict]) -> bytes:
+    return serializers.netflix_titles_response(results, exclude_none=True).body
+
+
+def main(perpage: int, repeat: int, db: bool):
+    results = db_results(perpage) if db else synthetic_results(perpage)
+    expected, actual = response_model_path(results), fast_path(results)
+    if expected != actual:
+        raise SystemExit("The fast path does not produce the same bytes as the response model.")
+
+    encoder = "orjson" if serializers.orjson is not None else "json"
+    print(f"{len(results)} titles, {len(actual)} bytes, {repeat} repeats, encoded with {encoder}")
+    timings = time_ms(lambda: response_model_path(results), repeat)
+    report("response model", timings)
+    fast_timings = time_ms(lambda: fast_path(results), repeat)
+    report("fast response", fast_timings)
+    print(f"speedup {statistics.median(timings) / statistics.median(fast_timings):.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--perpage", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--db", action="store_true", help="serialize a page read from the database")
+    args = parser.parse_args()
+    main(args.perpage, args.repeat, args.db)
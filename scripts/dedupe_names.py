@@ -0,0 +1,50 @@
+"""
+Merges director and cast member rows whose names differ only in case or whitespace.
+
+See netflix_show_api.db.dedupe. Run with --dry-run first to see how many rows would be merged,
+e.g.
+
+    python scripts/dedupe_names.py --dry-run
+    python scripts/dedupe_names.py --chunk-size 200 --pause-seconds 0.5
+"""
+import argparse
+
+from netflix_show_api.db.dedupe import PERSON_TABLES, merge_duplicates
+from netflix_show_api.db.queries import Session
+
+
+def main(tables, chunk_size: int, pause_seconds: float, dry_run: bool):
+    session = Session()
+    try:
+        for (table_name, association_table, related_id) in PERSON_TABLES:
+            if table_name not in tables:
+                continue
+            report = merge_duplicates(
+                session,
+                table_name,
+                association_table,
+                related_id,
+                chunk_size=chunk_size,
+                pause_seconds=pause_seconds,
+                dry_run=dry_run,
+            )
+            print(f"{report} (dry run)" if dry_run else report)
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    table_names = [table_name for (table_name, _, _) in PERSON_TABLES]
+    parser.add_argument(
+        "--table", action="append", choices=table_names, help="table to merge, defaults to all"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=500, help="groups of duplicates merged per transaction"
+    )
+    parser.add_argument(
+        "--pause-seconds", type=float, default=0.0, help="pause between transactions"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be merged")
+    args = parser.parse_args()
+    main(args.table or table_names, args.chunk_size, args.pause_seconds, args.dry_run)
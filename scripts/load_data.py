@@ -1,18 +1,27 @@
 """
 Extract data from a csv, transform it to match schema, and load into postgresql.
 """
+import argparse
+import csv
+import io
 import os
+import queue
 import random
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
 from operator import itemgetter
 from pprint import pprint
-from typing import Set
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
 
 import numpy as np
 import pandas as pd
 from pandas._libs.tslibs.timestamps import Timestamp
-from psycopg2.errors import UniqueViolation
 from netflix_show_api.db.schema import CastMember, Country, Director, Genre, NetflixTitle
-from netflix_show_api.db.queries import Session
+from netflix_show_api.db.queries import Session, engine
+from netflix_show_api.db import ids, invalidation
+from netflix_show_api.db.dedupe import normalize_name
 
 
 DATA_DIR = 'data'
@@ -72,8 +81,8 @@ COLUMN_MAP = {
 
 
 def clean(netflix_titles: pd.DataFrame, column_map = COLUMN_MAP) -> pd.DataFrame:
-    cleaned = netflix_titles.copy()
-    cleaned = cleaned.rename(columns=column_map)
+    # rename returns a copy, so the input frame is left as it is
+    cleaned = netflix_titles.rename(columns=column_map)
 
     # clean netflix show id
 
@@ -114,9 +123,7 @@ def clean(netflix_titles: pd.DataFrame, column_map = COLUMN_MAP) -> pd.DataFrame
     return cleaned
 
 
-def main(min_, commit_frequency=10, seed=None):
-    if seed is None:
-        seed = random.randint(1, 10 ** 4)
+def main(min_, commit_frequency=10):
     netflix_titles = load_dataframe('netflix_titles.csv')
     n = len(netflix_titles)
 
@@ -128,9 +135,6 @@ def main(min_, commit_frequency=10, seed=None):
     netflix_titles = clean(netflix_titles)
     netflix_titles = netflix_titles.iloc[min_:, :]
 
-    # allows for a rerun if there is a key collision
-    random.seed(seed)
-
     session = Session()
 
     try:
@@ -198,24 +202,309 @@ def main(min_, commit_frequency=10, seed=None):
                     )
                 )
                 if (i + 1) % commit_frequency == 0:
-                    try:
-                        session.commit()
-                    except UniqueViolation as uv:
-                        session.rollback()
-                        pprint('Primary key collision. Retrying with new random seed.')
-                        main(i + 1 - commit_frequency)
+                    session.commit()
         session.commit()
     except Exception as e:
         session.rollback()
         raise e
 
 
+# bulk loading
+
+
+# (csv column after cleaning, dimension table, association table, association column)
+DIMENSIONS = (
+    ('director', 'director', 'director_netflix_title', 'director_id'),
+    ('cast_members', 'cast_member', 'cast_member_netflix_title', 'cast_member_id'),
+    ('countries', 'country', 'country_netflix_title', 'country_id'),
+    ('genres', 'genre', 'genre_netflix_title', 'genre_id'),
+)
+
+
+TITLE_COLUMNS = (
+    'id',
+    'created',
+    'modified',
+    'netflix_show_id',
+    'title_type',
+    'title',
+    'netflix_date_added',
+    'release_year',
+    'rating',
+    'duration',
+    'duration_units',
+    'description',
+)
+
+
+def split_names(value) -> List[str]:
+    # distinct, non empty names in a comma delimited cell, in order
+    if not isinstance(value, str):
+        return []
+    # normalized like names written through the api, so reloads don't add near duplicates
+    names = (normalize_name(name) for name in value.split(','))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def csv_value(value):
+    # empty unquoted fields are read as null by COPY
+    if value is None or (not isinstance(value, str) and pd.isnull(value)):
+        return ''
+    if isinstance(value, Timestamp):
+        return value.date().isoformat()
+    return value
+
+
+class BulkWriter:
+    """
+    Streams rows into postgres with COPY, buffering up to 'chunk_size' rows per table at a time.
+    """
+
+    def __init__(self, cursor, chunk_size: int = 10000):
+        self.cursor = cursor
+        self.chunk_size = chunk_size
+        self.rows_written: Dict[str, int] = {}
+        self.seconds: Dict[str, float] = {}
+
+    def copy(self, table: str, columns: Tuple[str, ...], rows: Iterable[Tuple]):
+        start = time.perf_counter()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffered = 0
+        for row in rows:
+            writer.writerow([csv_value(v) for v in row])
+            buffered += 1
+            if buffered == self.chunk_size:
+                self._flush(table, columns, buffer, buffered)
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                buffered = 0
+        if buffered:
+            self._flush(table, columns, buffer, buffered)
+        self.seconds[table] = self.seconds.get(table, 0) + time.perf_counter() - start
+
+    def _flush(self, table, columns, buffer, buffered):
+        buffer.seek(0)
+        self.cursor.copy_expert(
+            f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer
+        )
+        self.rows_written[table] = self.rows_written.get(table, 0) + buffered
+
+    def report(self, total_seconds: float):
+        for table, rows in self.rows_written.items():
+            print_throughput(table, rows, self.seconds[table])
+        print_throughput('total', sum(self.rows_written.values()), total_seconds)
+
+
+def print_throughput(name: str, rows: int, seconds: float):
+    rate = rows / seconds if seconds else float('inf')
+    print(f'{name:<28} {rows:>8} rows {seconds:8.2f} s {rate:>10.0f} rows/s')
+
+
+def existing_ids_by_name(cursor, table: str) -> Dict[str, int]:
+    cursor.execute(f'SELECT name::text, id FROM {table} ORDER BY created NULLS LAST, id')
+    ids = {}
+    for name, id in cursor.fetchall():
+        # the first created row wins where names are duplicated
+        ids.setdefault(name, id)
+    return ids
+
+
+def reserve_ids(cursor, table: str, count: int) -> List[int]:
+    # same as netflix_show_api.db.ids.reserve_ids, on a raw cursor
+    cursor.execute(
+        'SELECT nextval(%s) FROM generate_series(1, %s)', (ids.sequence_name(table), count)
+    )
+    return [id for (id,) in cursor.fetchall()]
+
+
+class BulkLoader:
+    """
+    Loads cleaned frames of titles in a single transaction. Distinct director, cast member,
+    country and genre names are resolved against the database once, new ones get ids reserved
+    from their sequences in one round trip per chunk, and titles, names and association rows are
+    streamed in with COPY. Memory grows with the number of distinct names, not with the number of
+    titles.
+    """
+
+    def __init__(self, cursor, chunk_size: int = 10000):
+        self.cursor = cursor
+        self.writer = BulkWriter(cursor, chunk_size)
+        self.now = datetime.now().isoformat()
+
+        # names are resolved here, so keep other writers from adding them until the load commits
+        tables = [table for (_, table, _, _) in DIMENSIONS]
+        cursor.execute(f'LOCK TABLE {", ".join(tables)} IN SHARE ROW EXCLUSIVE MODE')
+
+        self.ids_by_name = {
+            table: existing_ids_by_name(cursor, table) for (_, table, _, _) in DIMENSIONS
+        }
+
+    def _assign_ids(self, table: str, count: int) -> List[int]:
+        if not count:
+            return []
+        return reserve_ids(self.cursor, table, count)
+
+    def load(self, netflix_titles: pd.DataFrame):
+        now = self.now
+        title_ids = self._assign_ids('netflix_title', len(netflix_titles))
+        rows = netflix_titles.itertuples(index=False)
+        self.writer.copy(
+            'netflix_title',
+            TITLE_COLUMNS,
+            (
+                (title_id, now, now, *(getattr(row, column) for column in TITLE_COLUMNS[3:]))
+                for title_id, row in zip(title_ids, rows)
+            ),
+        )
+
+        for column, table, association_table, association_column in DIMENSIONS:
+            ids = self.ids_by_name[table]
+            names_per_title = [split_names(value) for value in netflix_titles[column]]
+            new_names = list(
+                dict.fromkeys(
+                    name for names in names_per_title for name in names if name not in ids
+                )
+            )
+            new_ids = dict(zip(new_names, self._assign_ids(table, len(new_names))))
+            ids.update(new_ids)
+            self.writer.copy(
+                table,
+                ('id', 'created', 'modified', 'name'),
+                ((id, now, now, name) for name, id in new_ids.items()),
+            )
+            self.writer.copy(
+                association_table,
+                ('created', 'modified', association_column, 'netflix_title_id'),
+                (
+                    (now, now, ids[name], title_id)
+                    for title_id, names in zip(title_ids, names_per_title)
+                    for name in names
+                ),
+            )
+
+    def mark_stale(self):
+        # cached summaries and listings are stale, see netflix_show_api.db.invalidation
+        self.cursor.execute('UPDATE summary_snapshot SET dirty = true')
+        self.cursor.execute(
+            'SELECT pg_notify(%s, %s)',
+            (invalidation.CHANNEL, invalidation.encode_event(invalidation.EVERYTHING_DIRTY)),
+        )
+
+
+def bulk_load(frames: Iterable[pd.DataFrame], chunk_size: int = 10000):
+    start = time.perf_counter()
+    connection = engine.raw_connection()
+    try:
+        loader = BulkLoader(connection.cursor(), chunk_size)
+        titles = 0
+        for netflix_titles in frames:
+            loader.load(netflix_titles)
+            titles += len(netflix_titles)
+            print(f'loaded {titles} titles')
+        loader.mark_stale()
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    loader.writer.report(time.perf_counter() - start)
+
+
+# streaming ingestion
+
+
+_DONE = object()
+
+
+def clean_in_parallel(
+    chunks: Iterable[pd.DataFrame], workers: int, max_pending: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Cleans chunks in a pool of 'workers' processes and yields them in input order. A reader
+    thread submits chunks while at most 'max_pending' are being cleaned or waiting to be
+    consumed, so a slow consumer stops the reader instead of letting chunks pile up in memory.
+    """
+    pending = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def read(pool):
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    return
+                put(pool.submit(clean, chunk))
+            put(_DONE)
+        except Exception as e:
+            put(e)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        reader = threading.Thread(target=read, args=(pool,), name='csv-reader', daemon=True)
+        reader.start()
+        try:
+            while True:
+                item = pending.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item.result()
+        finally:
+            stop.set()
+            reader.join()
+            while not pending.empty():
+                item = pending.get_nowait()
+                if isinstance(item, Future):
+                    item.cancel()
+
+
+def main_bulk(
+    filename='netflix_titles.csv',
+    read_chunk_size=50000,
+    workers=None,
+    max_pending=None,
+    copy_chunk_size=10000,
+):
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    chunks = pd.read_csv(path_to_data_file(filename), chunksize=read_chunk_size)
+    bulk_load(clean_in_parallel(chunks, workers, max_pending), copy_chunk_size)
+
+
 if __name__ == '__main__':
-    # update min_ as batches complete successfully
-    # main(0)
-    # main(1500)
-    # main(3590)
-    # main(3660)
-    # main(4470)
-    # main(4700)
-    main(7170)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        '--row-by-row',
+        action='store_true',
+        help='load one row at a time through the ORM instead of in bulk with COPY',
+    )
+    parser.add_argument(
+        '--min', type=int, default=0, help='row to resume a row by row load from',
+    )
+    parser.add_argument('--file', default='netflix_titles.csv', help=f'csv file in {DATA_DIR!r}')
+    parser.add_argument('--read-chunk-size', type=int, default=50000, help='rows per csv chunk')
+    parser.add_argument(
+        '--workers', type=int, default=None, help='processes cleaning chunks, defaults to cpu count'
+    )
+    parser.add_argument(
+        '--max-pending',
+        type=int,
+        default=None,
+        help='chunks read ahead of the writer, defaults to twice the workers',
+    )
+    parser.add_argument('--chunk-size', type=int, default=10000, help='rows per COPY in bulk loads')
+    args = parser.parse_args()
+    if args.row_by_row:
+        # update --min as batches complete successfully
+        main(args.min)
+    else:
+        main_bulk(args.file, args.read_chunk_size, args.workers, args.max_pending, args.chunk_size)
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+from starlette.requests import Request
+
+from netflix_show_api.api.conditional import is_not_modified, page_validators, title_validators
+
+
+def _request(**headers):
+    raw_headers = [(k.replace("_", "-").encode(), v.encode()) for (k, v) in headers.items()]
+    return Request({"type": "http", "headers": raw_headers})
+
+
+def test_page_etag_changes_with_modification_times():
+    page = [(1, datetime(2021, 1, 1)), (2, datetime(2021, 1, 2))]
+    validators = page_validators(page)
+    assert validators == page_validators(list(page))
+    assert validators.etag != page_validators([page[0], (2, datetime(2021, 1, 3))]).etag
+    assert validators.etag != page_validators(page[:1]).etag
+    assert validators.etag != title_validators(*page[0]).etag
+    assert page_validators(page[:1]).etag != title_validators(*page[0]).etag
+
+
+def test_page_is_modified_when_a_title_is_deleted_from_it():
+    page = [(1, datetime(2021, 1, 1)), (2, datetime(2021, 1, 2))]
+    # title 2 was deleted and title 3, modified earlier, took its place
+    validators = page_validators([page[0], (3, datetime(2020, 1, 1))])
+    assert "Last-Modified" not in validators.headers()
+    since = title_validators(*page[1]).headers()["Last-Modified"]
+    assert not is_not_modified(_request(if_modified_since=since), validators)
+    assert not is_not_modified(_request(if_none_match=page_validators(page).etag), validators)
+
+
+def test_if_none_match_takes_precedence_over_if_modified_since():
+    validators = title_validators(1, datetime(2021, 1, 1))
+    since = validators.headers()["Last-Modified"]
+    assert is_not_modified(_request(if_none_match=f'"other", W/{validators.etag}'), validators)
+    assert is_not_modified(_request(if_modified_since=since), validators)
+    assert not is_not_modified(_request(if_none_match='"other"', if_modified_since=since), validators)
+    assert not is_not_modified(_request(), validators)
@@ -0,0 +1,49 @@
+import asyncio
+from datetime import date
+
+from netflix_show_api.api.export import encode
+from netflix_show_api.parsers import ExportFormat
+
+
+async def _batches():
+    yield [{"id": 1, "netflix_date_added": date(2021, 1, 1), "director": ["A", "B"]}]
+    yield [{"id": 2, "netflix_date_added": None, "director": []}]
+
+
+def _encode(format_):
+    async def collect():
+        return [chunk async for chunk in encode(_batches(), format_, ("id", "director"))]
+
+    return asyncio.run(collect())
+
+
+def test_csv_export_starts_with_a_header_and_joins_names():
+    assert _encode(ExportFormat.CSV) == ["id,director\r\n", '1,"A, B"\r\n', "2,\r\n"]
+
+
+def test_ndjson_export_encodes_one_title_per_line():
+    assert _encode(ExportFormat.NDJSON) == [
+        '{"id": 1, "netflix_date_added": "2021-01-01", "director": ["A", "B"]}\n',
+        '{"id": 2, "netflix_date_added": null, "director": []}\n',
+    ]
+
+
+def test_closing_the_export_closes_its_batches():
+    closed = []
+
+    async def batches():
+        try:
+            yield [{"id": 1}]
+            yield [{"id": 2}]
+        finally:
+            closed.append(True)
+
+    async def read_one_chunk():
+        body = encode(batches(), ExportFormat.NDJSON, ("id",))
+        chunk = await body.__anext__()
+        # the client disconnects
+        await body.aclose()
+        return chunk
+
+    assert asyncio.run(read_one_chunk()) == '{"id": 1}\n'
+    assert closed == [True]
@@ -0,0 +1,38 @@
+from datetime import date, datetime
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+import netflix_show_api.api.models as models
+import netflix_show_api.api.serializers as serializers
+
+RESULTS = [
+    {
+        "id": 1,
+        "created": datetime(2021, 4, 7, 12, 30),
+        "deleted": None,
+        "title_type": "movie",
+        "title": 'Él "quoted"\n',
+        "director": ["Agnès Varda"],
+        "cast_members": [],
+        "netflix_date_added": date(2021, 1, 1),
+        "release_year": None,
+        "duration_units": "minutes",
+        "duration": 90,
+    },
+    {"id": 2, "title": "Projected"},
+]
+
+
+def _response_model_body(exclude_none):
+    content = [models.NetflixTitle(**result) for result in RESULTS]
+    return JSONResponse(jsonable_encoder(content, exclude_none=exclude_none)).body
+
+
+def test_fast_response_matches_the_response_model(monkeypatch):
+    for exclude_none in (True, False):
+        expected = _response_model_body(exclude_none)
+        assert serializers.netflix_titles_response(RESULTS, exclude_none).body == expected
+        monkeypatch.setattr(serializers, "orjson", None)
+        assert serializers.netflix_titles_response(RESULTS, exclude_none).body == expected
+        monkeypatch.undo()
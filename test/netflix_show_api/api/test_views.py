@@ -0,0 +1,52 @@
+import asyncio
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+import netflix_show_api.db.queries as queries
+from netflix_show_api.api.views import _stream, app
+
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def test_sync_mode_endpoints_run_off_the_event_loop(monkeypatch):
+    loops = []
+
+    def get_netflix_title_by_id(id, session=None):
+        loops.append(_running_loop())
+        if id != 1:
+            return None
+        return {"id": 1, "title": "A Title", "modified": datetime(2021, 1, 1)}
+
+    monkeypatch.setattr(queries, "get_netflix_title_by_id", get_netflix_title_by_id)
+    client = TestClient(app)
+    response = client.get("/netflix-titles/1")
+    assert response.status_code == 200
+    assert response.json()["title"] == "A Title"
+    assert client.get("/netflix-titles/2").status_code == 404
+    assert loops == [None, None]
+
+
+def test_closing_a_sync_stream_closes_its_generator():
+    closed = []
+
+    def export():
+        try:
+            yield 1
+            yield 2
+        finally:
+            closed.append(True)
+
+    async def read_one():
+        stream = _stream(export)
+        item = await stream.__anext__()
+        await stream.aclose()
+        return item
+
+    assert asyncio.run(read_one()) == 1
+    assert closed == [True]
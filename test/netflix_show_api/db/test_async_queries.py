@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from netflix_show_api.cache import InProcessBackend, SQLiteBackend
+from netflix_show_api.config import Config
+from netflix_show_api.db.async_queries import (
+    _run_sync,
+    async_connection_url,
+    async_engine_options,
+    check_cache_backend,
+)
+
+
+def test_async_engine_uses_asyncpg_with_the_same_server_settings():
+    config = Config("postgresql://u:p@localhost/db", "dev", "s", 60, "logging.yaml")
+    config = config._replace(db_statement_timeout_ms=500)
+    assert async_connection_url(config.db_connection) == "postgresql+asyncpg://u:p@localhost/db"
+    options = async_engine_options(config)
+    assert options["connect_args"] == {"server_settings": {"statement_timeout": "500"}}
+    assert options["pool_size"] == config.db_pool_size
+
+
+def test_shared_cache_backends_are_refused(tmp_path):
+    check_cache_backend(None)
+    check_cache_backend(InProcessBackend(ttl=60))
+    with pytest.raises(ValueError):
+        check_cache_backend(SQLiteBackend(str(tmp_path / "cache.sqlite")))
+
+
+class _AsyncSession:
+    sync_session = object()
+
+    async def run_sync(self, f):
+        return f(self.sync_session)
+
+
+def test_run_sync_passes_the_sync_session_to_the_query():
+    def query(id, session=None):
+        return id, session
+
+    session = _AsyncSession()
+    assert asyncio.run(_run_sync(query, 1, session=session)) == (1, session.sync_session)
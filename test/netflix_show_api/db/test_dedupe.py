@@ -0,0 +1,32 @@
+from netflix_show_api.db.dedupe import chunked, merge_chunk, normalize_name
+
+
+def test_normalize_name_trims_and_collapses_whitespace():
+    assert normalize_name("  Martin \t Scorsese ") == "Martin Scorsese"
+
+
+def test_chunked_pairs_duplicates_with_their_survivor():
+    groups = [[1, 5, 9], [2, 3], [4, 7]]
+    assert list(chunked(groups, 2)) == [([5, 9, 3], [1, 1, 2]), ([7], [4])]
+
+
+class _RecordingSession:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, statement, params):
+        self.statements.append((" ".join(str(statement).split()), params))
+        return self
+
+    rowcount = 1
+
+
+def test_merge_chunk_bumps_the_modification_time_of_affected_titles():
+    session = _RecordingSession()
+    merge_chunk(session, "director", "director_netflix_title", "director_id", [5, 9], [1, 1])
+    statement, params = session.statements[0]
+    assert statement.startswith("UPDATE netflix_title SET modified = :now WHERE id IN (")
+    assert "SELECT netflix_title_id FROM director_netflix_title" in statement
+    assert "director_id = ANY(" in statement
+    assert params["now"] is not None
+    assert params["duplicate_ids"] == [5, 9]
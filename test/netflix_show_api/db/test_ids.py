@@ -0,0 +1,38 @@
+import pytest
+from sqlalchemy import Sequence
+
+from netflix_show_api.db.ids import BLOCK, SEQUENCE, BlockIdAllocator, id_default
+
+
+class _Connection:
+    def __init__(self):
+        self.next_id = 1
+        self.reservations = []
+
+    def execute(self, statement, params):
+        self.reservations.append(params)
+        ids = range(self.next_id, self.next_id + params["count"])
+        self.next_id += params["count"]
+        return [(id,) for id in ids]
+
+
+class _Context:
+    def __init__(self, connection):
+        self.connection = connection
+
+
+def test_block_allocator_reserves_one_block_at_a_time():
+    connection = _Connection()
+    allocate = BlockIdAllocator("director", block_size=3)
+    ids = [allocate(_Context(connection)) for _ in range(7)]
+    assert ids == [1, 2, 3, 4, 5, 6, 7]
+    assert connection.reservations == [{"sequence": "director_id_seq", "count": 3}] * 3
+
+
+def test_id_default():
+    sequence = id_default("genre", SEQUENCE, 10)
+    assert isinstance(sequence, Sequence)
+    assert sequence.name == "genre_id_seq"
+    assert id_default("genre", BLOCK, 10) is id_default("genre", BLOCK, 10)
+    with pytest.raises(ValueError):
+        id_default("genre", "hash", 10)
@@ -0,0 +1,71 @@
+import pytest
+
+import netflix_show_api.db.invalidation as invalidation
+from netflix_show_api.db.invalidation import (
+    EVERYTHING_DIRTY,
+    InvalidationEvent,
+    _listen,
+    decode_event,
+    encode_event,
+)
+
+
+@pytest.mark.parametrize("event", [
+    InvalidationEvent(title_id=123456789, lists_dirty=True),
+    InvalidationEvent(title_id=None, lists_dirty=True),
+    InvalidationEvent(title_id=42, lists_dirty=False),
+])
+def test_event_round_trip(event):
+    assert decode_event(encode_event(event)) == event
+
+
+@pytest.mark.parametrize("payload", ["", "not json", "[1, 2]"])
+def test_invalid_payload_invalidates_everything(payload):
+    assert decode_event(payload) == EVERYTHING_DIRTY
+
+
+class _DroppedConnection:
+    # a connection that goes quiet, and fails once it is used again
+    autocommit = False
+    notifies = []
+
+    def __init__(self):
+        self.statements = []
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, statement):
+        self.statements.append(statement)
+        if statement == "SELECT 1":
+            raise ConnectionError("server closed the connection unexpectedly")
+
+
+class _Engine:
+    def __init__(self, dbapi_connection):
+        self.connection = dbapi_connection
+        self.closed = False
+
+    def raw_connection(self):
+        return self
+
+    def detach(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def test_listener_notices_a_silently_dropped_connection(monkeypatch):
+    monkeypatch.setattr(invalidation.select, "select", lambda *args: ([], [], []))
+    engine = _Engine(_DroppedConnection())
+    with pytest.raises(ConnectionError):
+        _listen(engine, poll_seconds=0)
+    assert engine.connection.statements == [f"LISTEN {invalidation.CHANNEL}", "SELECT 1"]
+    assert engine.closed
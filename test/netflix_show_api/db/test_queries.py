@@ -0,0 +1,514 @@
+from collections import namedtuple
+from datetime import date, datetime
+
+import pytest
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import sessionmaker
+
+import netflix_show_api.db.queries as queries
+from netflix_show_api.api.models import NetflixTitlesSummary
+from netflix_show_api.db.queries import (
+    NetflixTitlesPage,
+    Session,
+    _add_filter_operations_to_query,
+    _after_cursor,
+    _compute_summary,
+    _decode_bar_plots,
+    _encode_cursor,
+    _Explain,
+    _insert_names_statement,
+    _parse_title_data,
+    _parsed_title_to_dict,
+    _projected_fields,
+    _relevance_rank,
+    _search_query,
+    _similarity_rank,
+    _sort_keys,
+    _title_row_to_dict,
+    create_new_netflix_titles,
+    export_fields,
+    export_query,
+    get_netflix_titles,
+    get_summary_snapshot,
+    new_query_on_aggregated_titles,
+    refresh_summary_snapshot,
+    upsert_names,
+)
+from netflix_show_api.db.schema import (
+    SUMMARY_SNAPSHOT_ID,
+    CastMember,
+    Country,
+    CountryEnum,
+    Director,
+    DurationUnitEnum,
+    Genre,
+    GenreEnum,
+    NetflixTitle,
+    RatingEnum,
+    SummarySnapshot,
+    TitleTypeEnum,
+)
+from netflix_show_api.db.constants import COUNTRY_ALIASES, GENRE_ALIASES
+from netflix_show_api.parsers import (
+    InvalidCursorError,
+    parse_cursor,
+    parse_filter_parameter,
+    parse_order_by,
+)
+
+
+def _row(**values):
+    return namedtuple("Row", values)(**values)
+
+
+def test_title_row_to_dict_matches_orm_to_dict():
+    now = datetime(2021, 4, 7, 12, 0, 0)
+    title = NetflixTitle(
+        id=123,
+        created=now,
+        modified=now,
+        netflix_show_id="s1",
+        title_type=TitleTypeEnum.movie,
+        title="A Title",
+        director=[Director(name="Some Director"), Director(name="")],
+        cast_members=[CastMember(name="Actor One"), CastMember(name="Actor Two")],
+        countries=[Country(name=CountryEnum["United States"])],
+        netflix_date_added=date(2020, 1, 1),
+        release_year=2019,
+        rating=RatingEnum["PG-13"],
+        duration=90,
+        duration_units=DurationUnitEnum.minutes,
+        genres=[Genre(name=GenreEnum["Dramas"])],
+        description="A description.",
+    )
+    row = _row(
+        id=123,
+        created=now,
+        modified=now,
+        deleted=None,
+        netflix_show_id="s1",
+        title_type=TitleTypeEnum.movie,
+        title="A Title",
+        netflix_date_added=date(2020, 1, 1),
+        release_year=2019,
+        rating=RatingEnum["PG-13"],
+        duration=90,
+        duration_units=DurationUnitEnum.minutes,
+        description="A description.",
+        director=["Some Director", ""],
+        cast_members=["Actor One", "Actor Two"],
+        countries=["United States"],
+        genres=["Dramas"],
+    )
+    assert _title_row_to_dict(row) == title.to_dict()
+
+
+def test_title_row_to_dict_without_related_objects():
+    row = _row(
+        id=1,
+        created=None,
+        modified=None,
+        deleted=None,
+        netflix_show_id=None,
+        title_type=None,
+        title=None,
+        netflix_date_added=None,
+        release_year=None,
+        rating=None,
+        duration=None,
+        duration_units=None,
+        description=None,
+        director=None,
+        cast_members=None,
+        countries=None,
+        genres=None,
+    )
+    assert _title_row_to_dict(row) == NetflixTitle(id=1).to_dict()
+
+
+def test_cursor_from_other_order_by_is_rejected():
+    row = _row(id=5, release_year=2019)
+    cursor = parse_cursor(_encode_cursor(_sort_keys(parse_order_by("release_year:desc")), row))
+    _after_cursor(_sort_keys(parse_order_by("release_year:desc")), cursor)
+    with pytest.raises(InvalidCursorError):
+        _after_cursor(_sort_keys(parse_order_by("release_year")), cursor)
+
+
+def test_related_filters_compile_to_exists_subqueries():
+    query = _add_filter_operations_to_query(
+        new_query_on_aggregated_titles(Session()),
+        parse_filter_parameter("eq:Dramas"),
+        None,
+        parse_filter_parameter("like:an"),
+        parse_filter_parameter("eq:Some Director"),
+        None,
+        GENRE_ALIASES,
+        COUNTRY_ALIASES,
+    )
+    sql = str(query.statement.compile(dialect=postgresql.dialect()))
+    # the association tables are only referenced from correlated subqueries
+    _, outer_where = sql.split("\nFROM netflix_title \nWHERE ")
+    assert outer_where.count("EXISTS (SELECT") == 3
+
+
+def test_similar_filter_ranks_and_resumes_from_cursor():
+    cast_member = parse_filter_parameter("similar:tom hanks")
+    rank = _similarity_rank(cast_member, None)
+    sort_keys = [(rank, True), *_sort_keys(None)]
+    cursor = _encode_cursor(sort_keys, _row(similarity=0.75, id=5))
+    assert parse_cursor(cursor) == ("similarity:desc,id", 0.75, 5)
+    clause = _after_cursor(sort_keys, parse_cursor(cursor))
+    sql = str(clause.compile(dialect=postgresql.dialect()))
+    assert "word_similarity" in sql
+    assert "%>" in sql
+
+
+def test_order_by_relevance_sorts_best_match_first():
+    ranks = {"relevance": _relevance_rank(_search_query(("space", "station")))}
+    sort_keys = _sort_keys(parse_order_by("relevance,title"), ranks)
+    assert [(column.key, descending) for (column, descending) in sort_keys] == [
+        ("relevance", True),
+        ("title", False),
+        ("id", False),
+    ]
+    sql = str(sort_keys[0][0].compile(dialect=postgresql.dialect()))
+    assert "websearch_to_tsquery" in sql
+    assert "ts_rank(netflix_title.search_vector" in sql
+
+
+def test_cursor_resumes_ranks_sorted_worst_match_first():
+    ranks = {"relevance": _relevance_rank(_search_query(("space",)))}
+    sort_keys = _sort_keys(parse_order_by("relevance:desc"), ranks)
+    assert [(column.key, descending) for (column, descending) in sort_keys] == [
+        ("relevance", False),
+        ("id", False),
+    ]
+    cursor = parse_cursor(_encode_cursor(sort_keys, _row(relevance=0.5, id=5)))
+    sql = str(_after_cursor(sort_keys, cursor).compile(dialect=postgresql.dialect()))
+    # better matches come after the cursor, and ranks are never null
+    assert sql.endswith("AS DOUBLE PRECISION), netflix_title.id) > (%(param_1)s, %(param_2)s)")
+
+
+def test_cursor_on_non_null_columns_in_one_direction_is_a_row_comparison():
+    sort_keys = _sort_keys(None)
+    cursor = parse_cursor(_encode_cursor(sort_keys, _row(id=5)))
+    sql = str(_after_cursor(sort_keys, cursor).compile(dialect=postgresql.dialect()))
+    assert sql == "(netflix_title.id) > (%(param_1)s)"
+    sort_keys = _sort_keys(parse_order_by("release_year"))
+    cursor = parse_cursor(_encode_cursor(sort_keys, _row(release_year=2019, id=5)))
+    sql = str(_after_cursor(sort_keys, cursor).compile(dialect=postgresql.dialect()))
+    assert "netflix_title.release_year IS NULL" in sql
+
+
+def test_sort_keys_ignore_unknown_and_unselected_columns():
+    sort_keys = _sort_keys(parse_order_by("relevance,search_vector,title:desc"))
+    assert [(column.key, descending) for (column, descending) in sort_keys] == [
+        ("title", True),
+        ("id", False),
+    ]
+
+
+def test_count_filters_match_listing_filters():
+    query = new_query_on_aggregated_titles(Session())
+    query = _add_filter_operations_to_query(
+        query,
+        None,
+        parse_filter_parameter("eq:United States"),
+        None,
+        None,
+        parse_filter_parameter("gt:2000", postprocess=int),
+        GENRE_ALIASES,
+        COUNTRY_ALIASES,
+        ("space",),
+    )
+    sql = str(_Explain(query.statement).compile(dialect=postgresql.dialect()))
+    assert sql.startswith("EXPLAIN (FORMAT JSON) SELECT")
+    assert "search_vector @@ websearch_to_tsquery" in sql
+    assert "netflix_title.release_year >" in sql
+
+
+def test_projection_selects_only_requested_columns_and_relationships():
+    fields = _projected_fields(frozenset(["title", "release_year"]), None)
+    sql = str(new_query_on_aggregated_titles(Session(), fields).statement)
+    select_list = sql[: sql.index("\nFROM netflix_title")]
+    assert select_list == (
+        "SELECT netflix_title.id, netflix_title.title, netflix_title.release_year "
+    )
+    row = _row(id=1, title="A Title", release_year=2019)
+    assert _title_row_to_dict(row) == {"id": 1, "title": "A Title", "release_year": 2019}
+
+
+def test_included_fields_keep_the_requested_headline(monkeypatch):
+    result = {"id": 1, "modified": None, "title": "Space", "headline": "<b>Space</b>"}
+    monkeypatch.setattr(
+        queries, "_query_results", lambda *args, **kwargs: NetflixTitlesPage([result], None)
+    )
+    page = get_netflix_titles(
+        1, 10, include=frozenset(["title"]), search=("headline test",), headline=True
+    )
+    assert page.results == [{"title": "Space", "headline": "<b>Space</b>"}]
+
+
+def test_listing_pages_are_cached_at_one_level():
+    assert hasattr(get_netflix_titles, "cache_info")
+    assert not hasattr(queries._query_results, "cache_info")
+    assert not hasattr(queries._count_titles, "cache_info")
+
+
+def test_projection_with_exclude_only():
+    fields = _projected_fields(None, frozenset(["cast_members", "description"]))
+    sql = str(new_query_on_aggregated_titles(Session(), fields).statement)
+    assert "cast_member" not in sql
+    assert "description" not in sql
+    assert "AS director" in sql
+
+
+def test_parsed_title_has_the_shape_of_a_created_title():
+    columns, related = _parse_title_data(
+        {
+            "title": "A Title",
+            "title_type": "movie",
+            "rating": "PG-13",
+            "director": ["Someone", "Someone"],
+            "countries": ["United States"],
+            "genres": ["Dramas", "Dramas"],
+        }
+    )
+    assert related["director"] == ["Someone"]
+    assert related["genres"] == [GenreEnum["Dramas"]]
+    created = datetime(2021, 1, 1)
+    title = _parsed_title_to_dict(1, created, columns, related)
+    assert title["id"] == 1
+    assert title["modified"] == created
+    assert title["title_type"] == "movie"
+    assert title["rating"] == "PG-13"
+    assert title["countries"] == ["United States"]
+    assert title["genres"] == ["Dramas"]
+    assert title["cast_members"] == []
+
+
+def test_bulk_create_reports_invalid_titles_without_touching_the_database():
+    results = create_new_netflix_titles(
+        [
+            {"title": "A Title", "rating": "not a rating"},
+            {"title": "Another Title", "title_type": "film"},
+        ]
+    )
+    assert [(result.index, result.netflix_title) for result in results] == [(0, None), (1, None)]
+    assert all(result.error for result in results)
+    assert "film" in results[1].error
+
+
+def test_insert_names_inserts_all_names_in_one_statement_without_locking_existing_rows():
+    statement = _insert_names_statement(Director, ["A Director", "Another Director"])
+    sql = str(statement.compile(dialect=postgresql.dialect()))
+    assert sql.startswith("INSERT INTO director")
+    assert sql.count("nextval('director_id_seq')") == 2
+    assert "ON CONFLICT (name) DO NOTHING" in sql
+    assert sql.endswith("RETURNING director.id, director.name")
+
+
+class _NamesSession:
+    # the insert returns only the new names, existing names are read with a select
+    def __init__(self, inserted, existing):
+        self.inserted, self.existing = inserted, existing
+        self.selected = None
+
+    def execute(self, statement):
+        return self.inserted
+
+    def query(self, *columns):
+        return self
+
+    def filter(self, criterion):
+        self.selected = criterion.right.value
+        return self.existing
+
+
+def test_upsert_names_reads_the_ids_of_existing_names():
+    session = _NamesSession(inserted=[(2, "New")], existing=[(1, "Dramas")])
+    assert upsert_names(session, Genre, ["New", "Dramas", "New"]) == {"New": 2, "Dramas": 1}
+    assert session.selected == ["Dramas"]
+    assert upsert_names(_NamesSession(inserted=[(2, "New")], existing=None), Genre, ["New"]) == {
+        "New": 2
+    }
+
+
+def test_export_applies_listing_filters_and_fields():
+    include, exclude = frozenset(["title", "director", "unknown"]), frozenset(["director"])
+    query = export_query(
+        Session(),
+        include,
+        exclude,
+        None,
+        parse_filter_parameter("Dramas"),
+        None,
+        None,
+        None,
+        parse_filter_parameter("gt:2000", postprocess=int),
+    )
+    sql = str(query.statement.compile(dialect=postgresql.dialect()))
+    assert sql.startswith("SELECT netflix_title.id, netflix_title.title \nFROM netflix_title")
+    assert "EXISTS (SELECT" in sql
+    assert "netflix_title.release_year >" in sql
+    assert sql.endswith("ORDER BY netflix_title.id")
+    assert export_fields(include, exclude) == ("title",)
+
+
+def _bar_plot_row(title_type, grouping, count, ratings=None, release_year=None, year_added=None):
+    return _row(
+        title_type=title_type,
+        ratings=ratings,
+        release_year=release_year,
+        year_added=year_added,
+        grouping=grouping,
+        count=count,
+    )
+
+
+BAR_PLOT_ROWS = [
+    # grouped by rating
+    _bar_plot_row(TitleTypeEnum.movie, 0b011, 4, ratings=RatingEnum["PG-13"]),
+    _bar_plot_row(TitleTypeEnum.movie, 0b011, 1, ratings=None),
+    # grouped by release year
+    _bar_plot_row(TitleTypeEnum.movie, 0b101, 3, release_year=2019),
+    _bar_plot_row(TitleTypeEnum.movie, 0b101, 2, release_year=None),
+    # grouped by year added
+    _bar_plot_row(TitleTypeEnum.movie, 0b110, 5, year_added=2020),
+    _bar_plot_row(TitleTypeEnum.tv_show, 0b110, 7, year_added=None),
+]
+
+
+def test_bar_plots_are_decoded_from_grouping_bitmasks():
+    bar_plots = dict(_decode_bar_plots(BAR_PLOT_ROWS, ["ratings", "release_year", "year_added"]))
+    assert bar_plots == {
+        TitleTypeEnum.movie: {
+            "ratings": {"PG-13": 4, "None": 1},
+            "release_year": {"2019": 3, "None": 2},
+            "year_added": {"2020": 5},
+        },
+        TitleTypeEnum.tv_show: {"ratings": {}, "release_year": {}, "year_added": {"None": 7}},
+    }
+
+
+def test_computed_summary_has_the_shape_of_the_response_model(monkeypatch):
+    duration = {
+        "count": 5,
+        "null": 0,
+        "mean": 90.0,
+        "std": 10.0,
+        "min": 80,
+        "percentile_25": 85,
+        "percentile_50": 90,
+        "percentile_75": 95,
+        "max": 100,
+    }
+    monkeypatch.setattr(
+        queries,
+        "_count_people_and_titles",
+        lambda session: {"directors": 2, "cast_members": 3, "titles": 12},
+    )
+    monkeypatch.setattr(
+        queries,
+        "_duration_statistics",
+        lambda session: [(TitleTypeEnum.movie, duration), (TitleTypeEnum.tv_show, duration)],
+    )
+    monkeypatch.setattr(
+        queries,
+        "_bar_plots",
+        lambda session: _decode_bar_plots(
+            BAR_PLOT_ROWS, ["ratings", "release_year", "year_added"]
+        ),
+    )
+    summary = NetflixTitlesSummary(**_compute_summary(None))
+    assert summary.titles == 12
+    assert summary.movies.ratings == {"PG-13": 4, "None": 1}
+    assert summary.movies.duration.count == 5
+    assert summary.shows.year_added == {"None": 7}
+    assert summary.shows.release_year == {}
+
+
+class _SnapshotSession:
+    # stands in for a session on the single summary snapshot row
+    def __init__(self, **row):
+        self.row = row
+
+    def query(self, model):
+        return self
+
+    def filter(self, *criteria):
+        self.dirty_only = any("dirty" in str(criterion) for criterion in criteria)
+        return self
+
+    def update(self, values, synchronize_session):
+        if self.dirty_only and not self.row["dirty"]:
+            return 0
+        self.row.update(values)
+        return 1
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_write_during_summary_refresh_leaves_the_snapshot_dirty(monkeypatch):
+    session = _SnapshotSession(dirty=True, summary=None, refreshed=None)
+
+    def compute_summary(session):
+        # the refresh has been claimed, and a title is written while the summary is computed
+        assert not session.row["dirty"]
+        session.row["dirty"] = True
+        return {"titles": 1}
+
+    monkeypatch.setattr(queries, "_compute_summary", compute_summary)
+    assert refresh_summary_snapshot(session=session) == {"titles": 1}
+    assert session.row["summary"] == {"titles": 1}
+    assert session.row["refreshed"] is not None
+    assert session.row["dirty"]
+
+
+def test_clean_summary_snapshot_is_not_refreshed(monkeypatch):
+    session = _SnapshotSession(dirty=False, summary={"titles": 1}, refreshed=None)
+    monkeypatch.setattr(queries, "_compute_summary", lambda session: {"titles": 2})
+    assert refresh_summary_snapshot(session=session) is None
+    assert refresh_summary_snapshot(force=True, session=session) == {"titles": 2}
+    assert not session.row["dirty"]
+
+
+def test_failed_summary_refresh_raises_its_own_error(monkeypatch):
+    class FailedSession(_SnapshotSession):
+        # the connection is gone by the time the refresh is handed back
+        def update(self, values, synchronize_session):
+            if values == {"dirty": True}:
+                raise ConnectionError("connection closed")
+            return super().update(values, synchronize_session)
+
+    def compute_summary(session):
+        raise ValueError("statement timeout")
+
+    monkeypatch.setattr(queries, "_compute_summary", compute_summary)
+    with pytest.raises(ValueError):
+        refresh_summary_snapshot(session=FailedSession(dirty=True, summary=None, refreshed=None))
+
+
+@compiles(postgresql.JSONB, "sqlite")
+def _compile_jsonb_for_sqlite(element, compiler, **kwargs):
+    return "JSON"
+
+
+def test_first_summary_is_read_back_when_sessions_are_not_expired_on_commit(monkeypatch):
+    # like the sessions of async mode
+    engine = create_engine("sqlite://")
+    SummarySnapshot.__table__.create(engine)
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    session.add(SummarySnapshot(id=SUMMARY_SNAPSHOT_ID, dirty=True))
+    session.commit()
+    monkeypatch.setattr(queries, "_compute_summary", lambda session: {"titles": 1})
+    summary, refreshed = get_summary_snapshot(session=session)
+    assert summary == {"titles": 1}
+    assert refreshed is not None
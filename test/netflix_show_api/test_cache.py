@@ -0,0 +1,240 @@
+import socketserver
+import threading
+import time
+
+import pytest
+
+from netflix_show_api.cache import (
+    InProcessBackend,
+    RedisBackend,
+    SQLiteBackend,
+    dumps,
+    loads,
+    timed_cache,
+)
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_timed_cache_expires_entries():
+    timer = FakeTimer()
+    calls = []
+
+    @timed_cache(seconds=10, timer=timer)
+    def f(x):
+        calls.append(x)
+        return x
+
+    f(1)
+    f(1)
+    timer.now = 10
+    f(1)
+    assert calls == [1, 1]
+    info = f.cache_info()
+    assert (info.hits, info.misses, info.expirations) == (1, 2, 1)
+
+
+def test_timed_cache_evicts_least_recently_used():
+    @timed_cache(seconds=10, maxsize=2)
+    def f(x):
+        return object()
+
+    a, b = f(1), f(2)
+    assert f(1) is a
+    f(3)
+    assert f(1) is a
+    assert f(2) is not b
+    assert f.cache_info().evictions == 2
+
+
+def test_timed_cache_respects_byte_budget():
+    @timed_cache(seconds=10, maxsize=None, max_bytes=250)
+    def f(x):
+        return "x" * 100
+
+    f(1)
+    f(2)
+    f(3)
+    info = f.cache_info()
+    assert info.currsize == 2
+    assert info.currbytes <= 250
+
+
+def test_timed_cache_key_ignores_arguments_and_call_style():
+    calls = []
+
+    @timed_cache(seconds=10, ignore=("session",))
+    def f(session, page, perpage=10, fields=None):
+        calls.append(page)
+        return page
+
+    f(object(), 1, fields=frozenset(["a", "b"]))
+    f(object(), page=1, perpage=10, fields=frozenset(["b", "a"]))
+    assert calls == [1]
+    assert f.cache_evict(None, 1, fields=frozenset(["a", "b"]))
+    f(object(), 1, fields=frozenset(["a", "b"]))
+    assert calls == [1, 1]
+
+
+def test_timed_cache_drops_results_computed_across_an_eviction():
+    calls = []
+
+    @timed_cache(seconds=10)
+    def f(x):
+        calls.append(x)
+        if len(calls) == 1:
+            # a write commits and its invalidation arrives while the result is computed
+            f.cache_clear()
+        return len(calls)
+
+    assert f(1) == 1
+    assert f(1) == 2
+    assert f(1) == 2
+    assert calls == [1, 1]
+
+
+def test_timed_cache_calls_through_on_unhashable_arguments():
+    @timed_cache(seconds=10)
+    def f(x):
+        return len(x)
+
+    assert f(bytearray(b"a")) == 1
+    assert f.cache_info().currsize == 0
+
+
+@pytest.mark.parametrize("value", [None, {"a": [1, 2.5, "b"]}, "x" * 10000])
+def test_serialization_round_trip(value):
+    data = dumps(value)
+    assert loads(data) == value
+    if isinstance(value, str):
+        assert len(data) < len(value)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """
+    Stand-in for a redis server, implementing the commands used by RedisBackend.
+    """
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            command = args[0].decode().upper()
+            with self.server.lock:
+                self.wfile.write(self._execute(store, command, args[1:]))
+
+    @staticmethod
+    def _live(store, key):
+        entry = store.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del store[key]
+            return None
+        return entry
+
+    def _execute(self, store, command, args):
+        if command == "GET":
+            entry = self._live(store, args[0])
+            if entry is None:
+                return b"$-1\r\n"
+            return b"$%d\r\n%s\r\n" % (len(entry[0]), entry[0])
+        if command == "SET":
+            key, value, options = args[0], args[1], [a.decode().upper() for a in args[2:]]
+            expires = None
+            if "PX" in options:
+                expires = time.monotonic() + int(options[options.index("PX") + 1]) / 1000
+            if "NX" in options and self._live(store, key) is not None:
+                return b"$-1\r\n"
+            store[key] = (value, expires)
+            return b"+OK\r\n"
+        if command == "DEL":
+            return b":%d\r\n" % int(store.pop(args[0], None) is not None)
+        if command == "INCR":
+            entry = self._live(store, args[0])
+            value = int(entry[0]) + 1 if entry else 1
+            store[args[0]] = (str(value).encode(), None)
+            return b":%d\r\n" % value
+        return b"-ERR unknown command\r\n"
+
+
+@pytest.fixture
+def redis_url():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.store = {}
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "redis://127.0.0.1:%d/0" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return InProcessBackend(ttl=60)
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    return RedisBackend(request.getfixturevalue("redis_url"))
+
+
+def test_backend_get_set_delete(backend):
+    assert backend.get("ns", ("k", 1)) == (False, None)
+    backend.set("ns", ("k", 1), {"value": [1, 2]}, ttl=60)
+    assert backend.get("ns", ("k", 1)) == (True, {"value": [1, 2]})
+    assert backend.delete("ns", ("k", 1))
+    assert backend.get("ns", ("k", 1)) == (False, None)
+
+
+def test_backend_add_only_sets_absent_keys(backend):
+    assert backend.add("ns", "k", 1, ttl=60)
+    assert not backend.add("ns", "k", 2, ttl=60)
+    assert backend.get("ns", "k") == (True, 1)
+
+
+def test_backend_clear_only_clears_namespace(backend):
+    backend.set("a", "k", 1, ttl=60)
+    backend.set("b", "k", 2, ttl=60)
+    backend.clear("a")
+    assert backend.get("a", "k") == (False, None)
+    assert backend.get("b", "k") == (True, 2)
+
+
+def test_backend_entries_expire(backend):
+    backend.set("ns", "k", 1, ttl=0.05)
+    time.sleep(0.1)
+    assert backend.get("ns", "k") == (False, None)
+    assert backend.add("ns", "k", 2, ttl=60)
+
+
+def test_shared_backend_computes_a_miss_once(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    calls = []
+
+    def f(x):
+        calls.append(x)
+        time.sleep(0.2)
+        return x
+
+    # separate backend instances stand in for separate workers
+    workers = [timed_cache(seconds=60, backend=SQLiteBackend(path))(f) for _ in range(4)]
+    results = []
+    threads = [threading.Thread(target=lambda w=w: results.append(w(1))) for w in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [1, 1, 1, 1]
+    assert calls == [1]
@@ -0,0 +1,35 @@
+import json
+import logging
+
+from netflix_show_api import loggers
+
+
+def test_trace_calls_samples_and_records_bounded_json(monkeypatch):
+    records = []
+    logger = logging.getLogger("test_trace_calls")
+    logger.setLevel(logging.INFO)
+    monkeypatch.setattr(logger, "handle", records.append)
+
+    @loggers.trace_calls(logger)
+    def add(a, b=0):
+        return a + b
+
+    name = f"{add.__module__}.{add.__qualname__}"
+    monkeypatch.setitem(loggers._sampling_rates, name, 0.0)
+    assert add(1, b=2) == 3
+    assert records == []
+
+    monkeypatch.setitem(loggers._sampling_rates, name, 1.0)
+    assert add("x" * 1000, b="y") == "x" * 1000 + "y"
+    (record,) = records
+    content = json.loads(loggers.JsonFormatter().format(record))
+    assert content["call"] == name
+    assert content["outcome"] == "returned"
+    assert len(content["call_args"]) < 300
+
+
+def test_queued_records_are_formatted_by_the_listener():
+    record = logging.makeLogRecord({"msg": "%s titles", "args": (3,)})
+    prepared = loggers._QueueHandler(None).prepare(record)
+    assert (prepared.msg, prepared.args) == ("%s titles", (3,))
+    assert prepared.getMessage() == "3 titles"
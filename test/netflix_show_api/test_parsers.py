@@ -0,0 +1,23 @@
+import pytest
+
+from netflix_show_api.parsers import InvalidCursorError, encode_cursor, parse_cursor
+
+
+@pytest.mark.parametrize("values", [
+    ("release_year:desc,id", 2019, 81234567),
+    ("title,id", "Étoile", 12),
+    ("id", None),
+])
+def test_cursor_round_trip(values):
+    assert parse_cursor(encode_cursor(values)) == values
+
+
+@pytest.mark.parametrize("cursor", [None, ""])
+def test_parse_empty_cursor(cursor):
+    assert parse_cursor(cursor) is None
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", encode_cursor([]), "eyJhIjogMX0"])
+def test_parse_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursorError):
+        parse_cursor(cursor)